@@ -0,0 +1,302 @@
+"""
+Benchmarks every AsyncKeyValueStorage backend with mixed read/write workloads.
+
+Reports operations per second, latency percentiles and bytes written for every backend,
+read ratio and concurrency level, then checks how long writers wait under heavy reads.
+
+Usage, from the repository root:
+    python -m benchmarks.storage_benchmark [--ops 2000] [--concurrency 1 8 64]
+"""
+import argparse
+import asyncio
+import io
+import random
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from hasherino.storage import (
+    AsyncKeyValueStorage,
+    MemoryOnlyStorage,
+    PersistentStorage,
+    SqliteStorage,
+)
+
+# Keys and values shaped like the settings the app stores
+KEYS = [f"setting_{i}" for i in range(32)]
+VALUES = [18, 0.5, True, "System", "forsen", {"emote": 12, "other": 3}]
+
+
+class _CountingStringIO(io.StringIO):
+    def __init__(self) -> None:
+        super().__init__()
+        self.bytes_written = 0
+
+    def write(self, s: str) -> int:
+        self.bytes_written += len(s.encode())
+        return super().write(s)
+
+
+class _Session:
+    """
+    Stands in for flet's page.session, a plain dict behind get/set/remove.
+    """
+
+    def __init__(self) -> None:
+        self._data = {}
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value):
+        self._data[key] = value
+
+    def remove(self, key):
+        self._data.pop(key, None)
+
+
+class _Page:
+    def __init__(self) -> None:
+        self.session = _Session()
+
+
+def _process_bytes_written() -> int | None:
+    """
+    Bytes this process passed to write calls so far, None where Linux's /proc isn't
+    available.
+    """
+    try:
+        with open("/proc/self/io") as file:
+            for line in file:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+
+@dataclass
+class Backend:
+    name: str
+    # Returns the storage and a function reporting bytes it wrote, if it can tell
+    make: Callable[[Path], tuple[AsyncKeyValueStorage, Callable[[], int | None]]]
+
+
+def _string_io_backend(flush_interval: float):
+    def make(_: Path):
+        file = _CountingStringIO()
+        storage = PersistentStorage(file, flush_interval=flush_interval)
+        return storage, lambda: file.bytes_written
+
+    return make
+
+
+def _json_file_backend(flush_interval: float):
+    def make(directory: Path):
+        # Absolute paths aren't joined to the settings path
+        return (
+            PersistentStorage(
+                str(directory / "db.json"), flush_interval=flush_interval
+            ),
+            lambda: None,
+        )
+
+    return make
+
+
+def _sqlite_backend(directory: Path):
+    return SqliteStorage(directory / "hasherino.db"), lambda: None
+
+
+BACKENDS = [
+    Backend("memory", lambda _: (MemoryOnlyStorage(_Page()), lambda: 0)),
+    Backend("json StringIO write-through", _string_io_backend(0)),
+    Backend("json StringIO write-behind", _string_io_backend(1.0)),
+    Backend("json file write-through", _json_file_backend(0)),
+    Backend("json file write-behind", _json_file_backend(1.0)),
+    Backend("sqlite file", _sqlite_backend),
+]
+
+
+@dataclass
+class Result:
+    ops: int
+    seconds: float
+    latencies: list[float]
+    bytes_written: int | None
+
+    @property
+    def ops_per_second(self) -> float:
+        return self.ops / self.seconds
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+
+async def _timed(latencies: list[float], operation: Awaitable):
+    start = time.perf_counter()
+    await operation
+    latencies.append(time.perf_counter() - start)
+
+
+async def run_workload(
+    backend: Backend, read_ratio: float, concurrency: int, ops: int
+) -> Result:
+    with tempfile.TemporaryDirectory() as directory:
+        storage, storage_bytes_written = backend.make(Path(directory))
+        await storage.set_many({key: random.choice(VALUES) for key in KEYS})
+
+        latencies: list[float] = []
+        ops_per_worker = max(ops // concurrency, 1)
+        process_bytes_before = _process_bytes_written()
+
+        async def worker(seed: int):
+            rng = random.Random(seed)
+
+            for _ in range(ops_per_worker):
+                key = rng.choice(KEYS)
+
+                if rng.random() < read_ratio:
+                    await _timed(latencies, storage.get(key))
+                else:
+                    await _timed(latencies, storage.set(key, rng.choice(VALUES)))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(seed) for seed in range(concurrency)))
+        # Pending write-behind flushes are part of the cost of the writes
+        await storage.close()
+        seconds = time.perf_counter() - start
+
+        bytes_written = storage_bytes_written()
+        process_bytes_after = _process_bytes_written()
+        if bytes_written is None and process_bytes_before is not None:
+            bytes_written = process_bytes_after - process_bytes_before
+
+        return Result(len(latencies), seconds, latencies, bytes_written)
+
+
+async def check_writer_starvation(
+    backend: Backend, readers: int, duration: float, max_wait: float
+) -> tuple[float, bool]:
+    """
+    Runs readers in tight loops while a writer keeps setting a key, returns the longest
+    time a single write took and whether it stayed under max_wait.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        storage, _ = backend.make(Path(directory))
+        await storage.set_many({key: 0 for key in KEYS})
+        deadline = time.perf_counter() + duration
+        write_latencies: list[float] = []
+
+        async def reader():
+            while time.perf_counter() < deadline:
+                await storage.get(random.choice(KEYS))
+
+        async def writer():
+            value = 0
+            while time.perf_counter() < deadline:
+                value += 1
+                await _timed(write_latencies, storage.set(KEYS[0], value))
+                await asyncio.sleep(0)
+
+        await asyncio.gather(writer(), *(reader() for _ in range(readers)))
+        await storage.close()
+
+        longest = max(write_latencies, default=float("inf"))
+        return longest, longest <= max_wait
+
+
+def _format_bytes(value: int | None) -> str:
+    if value is None:
+        return "n/a"
+
+    for unit in ("B", "KiB", "MiB"):
+        if value < 1024:
+            return f"{value:.0f}{unit}"
+        value /= 1024
+
+    return f"{value:.1f}GiB"
+
+
+async def main(args: argparse.Namespace):
+    backends = [
+        backend
+        for backend in BACKENDS
+        if not args.backends or any(name in backend.name for name in args.backends)
+    ]
+
+    print(
+        f"{'backend':<30} {'reads':>5} {'conc':>4} {'ops/s':>10} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'written':>9}"
+    )
+
+    for backend in backends:
+        for read_ratio in args.read_ratios:
+            for concurrency in args.concurrency:
+                result = await run_workload(backend, read_ratio, concurrency, args.ops)
+                print(
+                    f"{backend.name:<30} {read_ratio:>5.0%} {concurrency:>4} "
+                    f"{result.ops_per_second:>10.0f} "
+                    f"{result.percentile(0.5) * 1000:>8.3f} "
+                    f"{result.percentile(0.99) * 1000:>8.3f} "
+                    f"{max(result.latencies) * 1000:>8.3f} "
+                    f"{_format_bytes(result.bytes_written):>9}"
+                )
+
+    print()
+    print(
+        f"Writer starvation, {args.readers} readers for {args.duration}s, "
+        f"limit {args.max_writer_wait * 1000:.0f}ms per write"
+    )
+
+    failed = False
+    for backend in backends:
+        longest, ok = await check_writer_starvation(
+            backend, args.readers, args.duration, args.max_writer_wait
+        )
+        failed |= not ok
+        print(
+            f"{backend.name:<30} longest write {longest * 1000:>10.3f}ms "
+            f"{'ok' if ok else 'STARVED'}"
+        )
+
+    return 1 if failed else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ops", type=int, default=2000, help="Operations per run")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 8, 64], help="Worker tasks"
+    )
+    parser.add_argument(
+        "--read-ratios",
+        type=float,
+        nargs="+",
+        default=[0.9, 0.5, 0.1],
+        help="Fraction of operations that are reads",
+    )
+    parser.add_argument(
+        "--backends", nargs="*", help="Only run backends whose name contains these"
+    )
+    parser.add_argument(
+        "--readers", type=int, default=64, help="Readers in the starvation check"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=2.0, help="Seconds of the starvation check"
+    )
+    parser.add_argument(
+        "--max-writer-wait",
+        type=float,
+        default=0.1,
+        help="Seconds a write may wait before the writer counts as starved",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main(parse_args())))
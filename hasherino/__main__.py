@@ -1,10 +1,14 @@
 import asyncio
 import logging
+from typing import Awaitable, Callable
 
 import flet as ft
 
 from hasherino import user_auth
-from hasherino.api import helix
+from hasherino.api import helix, helix_client, http_client, response_cache
+from hasherino.api.seven_tv_events import SevenTVEvents, apply_emote_set_update
+from hasherino.badge_index import BadgeIndex
+from hasherino.channel_log import ChannelLog
 from hasherino.components import (
     AccountDialog,
     ChatContainer,
@@ -14,14 +18,19 @@ from hasherino.components import (
     Tabs,
 )
 from hasherino.components.settings_view import LOG_PATH
-from hasherino.factory import message_factory
+from hasherino.emote_prefetcher import EmotePrefetcher
+from hasherino.emote_set_catalog import EmoteSetCatalog
+from hasherino.factory import message_factory, on_emotes_reloaded
 from hasherino.hasherino_dataclasses import Emote, HasherinoUser
+from hasherino.image_cache import ImageCache
 from hasherino.parse_irc import Command, ParsedMessage
-from hasherino.pubsub import PubSub
+from hasherino.pubsub import PubSub, Topic
+from hasherino.secret_store import SecretStore
+from hasherino.settings import Settings
 from hasherino.storage import (
     AsyncKeyValueStorage,
     MemoryOnlyStorage,
-    PersistentStorage,
+    SqliteStorage,
     get_default_os_settings_path,
 )
 from hasherino.twitch_websocket import TwitchWebsocket
@@ -30,26 +39,31 @@ from hasherino.twitch_websocket import TwitchWebsocket
 class Hasherino:
     def __init__(
         self,
-        font_size_pubsub: PubSub,
-        ts_pubsub: PubSub,
+        pubsub: PubSub,
         memory_storage: AsyncKeyValueStorage,
         persistent_storage: AsyncKeyValueStorage,
+        settings: Settings,
         page: ft.Page,
     ) -> None:
-        self.font_size_pubsub = font_size_pubsub
-        self.ts_pubsub = ts_pubsub
+        self.pubsub = pubsub
         self.memory_storage = memory_storage
         self.persistent_storage = persistent_storage
+        self.settings = settings
         self.page = page
         self.page.is_ctrl_pressed = False
         self.message_listener: None | asyncio.Task = None
-        self.emote_set_cache: dict[str, list[Emote]] = dict()
+        # Emote sets of the user whose emotes are in ttv_emote_sets, None until the first
+        # USERSTATE so its emotes are always published
+        self.emote_set_ids: set[str] | None = None
+        self.emote_sets_task: asyncio.Task | None = None
+        # Latest emote sets received while emote_sets_task was running
+        self.pending_emote_set_ids: set[str] | None = None
 
     async def login_click(self, _):
         logging.debug("Clicked login")
 
-        app_id = await self.persistent_storage.get("app_id")
-        token = await user_auth.request_oauth_token(app_id)
+        app_id = self.settings.app_id
+        token, expires_in = await user_auth.request_oauth_token(app_id)
         users = await helix.get_users(app_id, token, [])
 
         if users:
@@ -65,16 +79,25 @@ class Hasherino:
                     reconnect_callback=self.status_column.set_reconnecting_status,
                     token=token,
                     username=users[0].login,
-                    join_channel=await self.persistent_storage.get("channel"),
+                    join_channel=self.settings.channel,
                 )
             )
 
+            # Setting the token clears its expiry, so it's recorded after
+            await self.persistent_storage.set("token", token)
+
+            if expires_in is not None:
+                secret_store: SecretStore = await self.memory_storage.get(
+                    "secret_store"
+                )
+                secret_store.set_expiry("token", expires_in)
+
             asyncio.gather(
-                self.persistent_storage.set("token", token),
-                self.persistent_storage.set("user_name", users[0].display_name),
-                self.persistent_storage.set("user_id", users[0].id),
-                self.memory_storage.set(
-                    "ttv_badges", await helix.get_global_badges(app_id, token)
+                self.settings.update_many(
+                    {"user_name": users[0].display_name, "user_id": users[0].id}
+                ),
+                (await self.memory_storage.get("badge_index")).load_global(
+                    app_id, token
                 ),
             )
         else:
@@ -87,13 +110,64 @@ class Hasherino:
 
     async def settings_click(self, _):
         logging.debug("Clicked on settings")
-        sv = SettingsView(
-            self.font_size_pubsub, self.ts_pubsub, self.persistent_storage
-        )
+        sv = SettingsView(self.settings)
         await sv.init()
         self.page.views.append(sv)
         await self.page.update_async()
 
+    async def update_pending_emote_sets(self):
+        """
+        Runs update_emote_sets until no newer emote sets are waiting.
+        """
+        while (set_ids := self.pending_emote_set_ids) is not None:
+            self.pending_emote_set_ids = None
+            await self.update_emote_sets(set_ids)
+
+    async def update_emote_sets(self, set_ids: set[str]):
+        """
+        Loads the user's emotes from the emote set catalog, then fetches the sets that
+        aren't in it yet.
+        """
+        catalog: EmoteSetCatalog = await self.memory_storage.get("emote_set_catalog")
+
+        async def reload_emotes():
+            await self.memory_storage.set("ttv_emote_sets", catalog.emotes(set_ids))
+            await self.pubsub.send(Topic.EMOTES_RELOADED, None)
+
+        if set_ids != self.emote_set_ids:
+            self.emote_set_ids = set_ids
+            await reload_emotes()
+
+        try:
+            if await catalog.update(
+                self.settings.app_id,
+                await self.persistent_storage.get("token"),
+                set_ids,
+            ):
+                await reload_emotes()
+        except Exception as e:
+            logging.warning(f"Unable to update emote sets: {e}")
+
+    async def on_seventv_emote_set_update(self, emote_set_id: str, body: dict):
+        """
+        Applies a live change of a 7TV emote set to the channels using it.
+        """
+        emote_set_ids: dict[str, str] = (
+            await self.memory_storage.get("7tv_emote_set_ids") or {}
+        )
+        emotes: dict[str, dict[str, Emote]] = (
+            await self.memory_storage.get("7tv_emotes") or {}
+        )
+        global_emotes: dict[str, Emote] = (
+            await self.memory_storage.get("7tv_global_emotes") or {}
+        )
+
+        for channel, channel_set_id in emote_set_ids.items():
+            if channel_set_id == emote_set_id and channel in emotes:
+                if apply_emote_set_update(emotes[channel], body, global_emotes):
+                    logging.info(f"Updated 7TV emotes of {channel}")
+                    await self.pubsub.send(Topic.EMOTES_RELOADED, channel)
+
     async def message_received(self, message: ParsedMessage):
         logging.debug(f"Received message with command {message.get_command()}")
 
@@ -101,14 +175,16 @@ class Hasherino:
             case Command.USERSTATE:
                 if (
                     message.get_author_displayname().lower()
-                    == (await self.persistent_storage.get("user_name")).lower()
+                    == self.settings.user_name.lower()
                 ):
                     async with asyncio.TaskGroup() as tg:
                         tg.create_task(
                             self.memory_storage.set(
                                 "user_badges",
                                 message.get_badges(
-                                    await self.memory_storage.get("ttv_badges")
+                                    (
+                                        await self.memory_storage.get("badge_index")
+                                    ).for_channel(message.get_channel())
                                 ),
                             )
                         )
@@ -119,49 +195,39 @@ class Hasherino:
                             )
                         )
 
-                        if not await self.memory_storage.get("ttv_emote_sets"):
-                            emotes: dict[str, Emote] = dict()
-
-                            for emote_obj in await helix.get_all_emote_sets(
-                                await self.persistent_storage.get("app_id"),
-                                await self.persistent_storage.get("token"),
-                                set(message.get_emote_sets()),
-                            ):
-                                emotes[emote_obj["name"]] = Emote(
-                                    name=emote_obj["name"],
-                                    id=emote_obj["id"],
-                                    url=f"https://static-cdn.jtvnw.net/emoticons/v2/{emote_obj['id']}/default/dark/2.0",
-                                )
-
-                            tg.create_task(
-                                self.memory_storage.set("ttv_emote_sets", emotes)
-                            )
+                    # Fetching new emote sets can take a while, don't hold up messages.
+                    # A running update picks up the latest sets once it's done
+                    self.pending_emote_set_ids = set(message.get_emote_sets())
+
+                    if self.emote_sets_task is None or self.emote_sets_task.done():
+                        self.emote_sets_task = asyncio.create_task(
+                            self.update_pending_emote_sets()
+                        )
 
             case Command.PRIVMSG:
                 author: str = message.get_author_displayname()
 
-                emote_map: dict[str, Emote] = await self.memory_storage.get(
-                    "ttv_emote_sets"
-                )
-
                 stv_emotes: dict[
                     str, dict[str, Emote]
                 ] | None = await self.memory_storage.get("7tv_emotes")
-                channel = await self.persistent_storage.get("channel")
+                channel = self.settings.channel
                 if stv_emotes and channel:
-                    channel_stv_emotes = stv_emotes.get(
-                        await self.persistent_storage.get("channel"), {}
-                    )
+                    channel_stv_emotes = stv_emotes.get(channel, {})
                 else:
                     channel_stv_emotes = {}
 
-                emote_map.update(channel_stv_emotes)
+                # A new map per message, so 7TV emotes never pile up in ttv_emote_sets
+                emote_map: dict[str, Emote] = (
+                    await self.memory_storage.get("ttv_emote_sets") or {}
+                ) | channel_stv_emotes
 
                 message_obj = message_factory(
                     HasherinoUser(
                         name=author,
                         badges=message.get_badges(
-                            await self.memory_storage.get("ttv_badges")
+                            (await self.memory_storage.get("badge_index")).for_room(
+                                message.get_room_id()
+                            )
                         ),
                         chat_color=message.get_author_chat_color(),
                     ),
@@ -181,13 +247,9 @@ class Hasherino:
             websocket: TwitchWebsocket = await self.memory_storage.get("websocket")
             channel.error_text = ""
 
-            if await self.persistent_storage.get("channel"):
-                logging.info(
-                    f"Leaving channel {await self.persistent_storage.get('channel')}"
-                )
-                await websocket.leave_channel(
-                    await self.persistent_storage.get("channel")
-                )
+            if self.settings.channel:
+                logging.info(f"Leaving channel {self.settings.channel}")
+                await websocket.leave_channel(self.settings.channel)
 
             logging.info(f"Joining channel {channel.value}")
 
@@ -199,9 +261,10 @@ class Hasherino:
                 await self.page.update_async()
                 return
 
+            # Set first, the history replayed by add_tab is logged under it
+            await self.settings.update("channel", channel.value)
             await self.tabs.add_tab(channel.value, self.message_received)
             await self.chat_container.chat.scroll_to_async(offset=-1, duration=10)
-            await self.persistent_storage.set("channel", channel.value)
             self.page.dialog.open = False
 
             await self.page.update_async()
@@ -217,15 +280,52 @@ class Hasherino:
 
     async def on_resize(self, _):
         if self.page.window_height > 100 and self.page.window_width > 100:
-            async with asyncio.TaskGroup() as tg:
-                tg.create_task(
-                    self.persistent_storage.set(
-                        "window_height", self.page.window_height
-                    )
-                )
-                tg.create_task(
-                    self.persistent_storage.set("window_width", self.page.window_width)
-                )
+            await self.settings.update_many(
+                {
+                    "window_height": self.page.window_height,
+                    "window_width": self.page.window_width,
+                }
+            )
+
+    async def on_window_event(self, e: ft.ControlEvent):
+        if e.data != "close":
+            return
+
+        logging.debug("Window closing, saving state")
+
+        try:
+            for key, save in (
+                ("emote_prefetcher", "save"),
+                ("image_cache", "save_index"),
+                ("channel_log", "flush"),
+            ):
+                if component := await self.memory_storage.get(key):
+                    await self._close_step(f"{key}.{save}", getattr(component, save))
+
+            for endpoint, stats in helix_client.get_stats().items():
+                logging.info(f"Helix {endpoint} requests: {stats}")
+
+            await self._close_step("settings.flush", self.settings.flush)
+
+            if seventv_events := await self.memory_storage.get("seventv_events"):
+                await self._close_step("seventv_events.close", seventv_events.close)
+
+            await self._close_step("http_client.close", http_client.close)
+            # Last, every storage namespace shares the database, e.g. http_cache is still
+            # written to by requests finishing above
+            await self._close_step(
+                "persistent_storage.close", self.persistent_storage.close
+            )
+        finally:
+            # Whatever failed to save, the window must still close
+            await self.page.window_destroy_async()
+
+    @staticmethod
+    async def _close_step(name: str, step: Callable[[], Awaitable]):
+        try:
+            await step()
+        except Exception:
+            logging.exception(f"{name} failed while closing the window")
 
     async def on_kb_event(self, e: ft.KeyboardEvent):
         self.page.is_ctrl_pressed = e.ctrl
@@ -240,11 +340,11 @@ class Hasherino:
             await self.new_message_row.cycle_messages(e.key)
 
     async def run(self):
-        self.page.window_width = await self.persistent_storage.get("window_width")
-        self.page.window_height = await self.persistent_storage.get("window_height")
+        self.page.window_width = self.settings.window_width
+        self.page.window_height = self.settings.window_height
         self.page.on_keyboard_event = self.on_kb_event
 
-        match await self.persistent_storage.get("theme"):
+        match self.settings.theme:
             case "System":
                 self.page.theme_mode = ft.ThemeMode.SYSTEM
             case "Dark mode":
@@ -255,26 +355,40 @@ class Hasherino:
                 pass
 
         self.page.on_resize = self.on_resize
+        # Pending writes are flushed before the window is destroyed
+        self.page.window_prevent_close = True
+        self.page.on_window_event = self.on_window_event
+        await self.pubsub.subscribe(Topic.EMOTES_RELOADED, on_emotes_reloaded)
         self.page.horizontal_alignment = "stretch"
         self.page.title = "Hasherino"
 
-        self.page.dialog = AccountDialog(self.persistent_storage)
+        self.page.dialog = AccountDialog(self.settings)
         self.page.dialog.open = False
 
-        self.status_column = StatusColumn(self.memory_storage, self.persistent_storage)
-        chat_container = ChatContainer(
-            self.persistent_storage,
-            self.memory_storage,
-            self.font_size_pubsub,
-            self.ts_pubsub,
+        self.status_column = StatusColumn(
+            self.memory_storage, self.settings, self.pubsub
+        )
+        chat_container = ChatContainer(self.settings, self.memory_storage)
+        await self.pubsub.subscribe(
+            Topic.FONT_SIZE, chat_container.on_font_size_changed
+        )
+        await self.pubsub.subscribe(
+            Topic.SHOW_TIMESTAMP, chat_container.on_show_timestamp_changed
+        )
+        chat_container.low_power_mode = self.settings.low_power_mode
+        await self.pubsub.subscribe(
+            Topic.LOW_POWER_MODE, chat_container.on_low_power_mode_changed
         )
         self.new_message_row = NewMessageRow(
             self.memory_storage,
             self.persistent_storage,
+            self.settings,
             chat_container.on_message,
             self.status_column.set_reconnecting_status,
         )
-        self.tabs = Tabs(self.memory_storage, self.persistent_storage)
+        self.tabs = Tabs(
+            self.memory_storage, self.persistent_storage, self.settings, self.pubsub
+        )
 
         self.chat_container_on_msg = chat_container.on_message
         self.chat_container = chat_container
@@ -316,10 +430,10 @@ class Hasherino:
             ),
         )
 
-        if user_name := await self.persistent_storage.get("user_name"):
+        if user_name := self.settings.user_name:
             websocket: TwitchWebsocket = await self.memory_storage.get("websocket")
 
-            channel = await self.persistent_storage.get("channel")
+            channel = self.settings.channel
             token = await self.persistent_storage.get("token")
 
             self.message_listener = asyncio.create_task(
@@ -336,13 +450,8 @@ class Hasherino:
                 await self.tabs.add_tab(channel, self.message_received)
                 await self.chat_container.chat.scroll_to_async(offset=-1, duration=10)
 
-            await self.memory_storage.set(
-                "ttv_badges",
-                await helix.get_global_badges(
-                    await self.persistent_storage.get("app_id"),
-                    token,
-                ),
-            )
+            badge_index: BadgeIndex = await self.memory_storage.get("badge_index")
+            await badge_index.load_global(self.settings.app_id, token)
 
 
 async def main(page: ft.Page):
@@ -366,35 +475,64 @@ async def main(page: ft.Page):
     logging.getLogger("flet_core").setLevel(logging.INFO)
     logging.getLogger("flet_runtime").setLevel(logging.INFO)
 
-    persistent_storage = PersistentStorage()
+    secret_store = SecretStore()
+    persistent_storage = SqliteStorage(secrets=secret_store)
+    await persistent_storage.migrate_json()
+    await response_cache.load(persistent_storage.with_namespace("http_cache"))
     memory_storage = MemoryOnlyStorage(page)
+    await memory_storage.set("secret_store", secret_store)
 
     app_id = "hvmj7blkwy2gw3xf820n47i85g4sub"
 
+    # Connect to twitch and 7tv while the rest of the app loads
+    asyncio.create_task(http_client.warm_up())
+
     websocket = TwitchWebsocket()
     await memory_storage.set("websocket", websocket)
 
-    if await persistent_storage.get("token"):
-        renewed_token = await user_auth.request_oauth_token(
-            app_id, await persistent_storage.get("token")
-        )
-        await persistent_storage.set("token", renewed_token)
+    image_cache = ImageCache(get_default_os_settings_path() / "image_cache")
+    await image_cache.load()
+    await memory_storage.set("image_cache", image_cache)
+
+    emote_prefetcher = EmotePrefetcher(image_cache, persistent_storage)
+    await emote_prefetcher.load()
+    await memory_storage.set("emote_prefetcher", emote_prefetcher)
+
+    await memory_storage.set("badge_index", BadgeIndex())
+
+    emote_set_catalog = EmoteSetCatalog(persistent_storage.with_namespace("emote_sets"))
+    await emote_set_catalog.load()
+    await memory_storage.set("emote_set_catalog", emote_set_catalog)
+
+    await memory_storage.set(
+        "channel_log", ChannelLog(get_default_os_settings_path() / "logs")
+    )
+
+    if token := await persistent_storage.get("token"):
+        renewed_token, expires_in = await user_auth.request_oauth_token(app_id, token)
+
+        if renewed_token != token:
+            await persistent_storage.set("token", renewed_token)
+
+        if expires_in is not None:
+            secret_store.set_expiry("token", expires_in)
 
     if not await persistent_storage.get("not_first_run"):
-        async with asyncio.TaskGroup() as tg:
-            tg.create_task(persistent_storage.set("app_id", app_id))
-            tg.create_task(persistent_storage.set("chat_font_size", 18))
-            tg.create_task(persistent_storage.set("chat_update_rate", 0.5))
-            tg.create_task(persistent_storage.set("chat_history", True))
-            tg.create_task(persistent_storage.set("color_switcher", False))
-            tg.create_task(persistent_storage.set("max_messages_per_chat", 100))
-            tg.create_task(persistent_storage.set("not_first_run", True))
-            tg.create_task(persistent_storage.set("show_timestamp", True))
-            tg.create_task(persistent_storage.set("theme", "System"))
-            tg.create_task(persistent_storage.set("window_width", 500))
-            tg.create_task(persistent_storage.set("window_height", 800))
-
-    hasherino = Hasherino(PubSub(), PubSub(), memory_storage, persistent_storage, page)
+        defaults = Settings(app_id=app_id).as_dict()
+        await persistent_storage.set_many(
+            {name: value for name, value in defaults.items() if value is not None}
+            | {"not_first_run": True}
+        )
+
+    pubsub = PubSub()
+    settings = await Settings.load(persistent_storage, pubsub)
+
+    hasherino = Hasherino(pubsub, memory_storage, persistent_storage, settings, page)
+
+    seventv_events = SevenTVEvents(hasherino.on_seventv_emote_set_update)
+    seventv_events.start()
+    await memory_storage.set("seventv_events", seventv_events)
+
     await hasherino.run()
 
 
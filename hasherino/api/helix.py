@@ -1,17 +1,53 @@
 import asyncio
 import enum
-import itertools
 import logging
-import ssl
 from dataclasses import dataclass
+from functools import partial
 from typing import Iterable
+from urllib.parse import urlencode
+
+from hasherino.api import helix_client
+from hasherino.api.helix_client import Priority
+from hasherino.api.response_cache import ResponseError, cached_json
+from hasherino.hasherino_dataclasses import Emote, EmoteSource
+
+__all__ = [
+    "Priority",
+    "BatchError",
+    "BatchResult",
+    "get_batched",
+    "get_users",
+    "update_chat_color",
+    "emote_from_helix",
+    "TwitchUser",
+    "NormalUserColor",
+]
 
-import certifi
-from aiohttp import ClientSession, TCPConnector
+_BASE_URL = "https://api.twitch.tv/helix/"
 
-__all__ = ["get_users", "update_chat_color", "TwitchUser", "NormalUserColor"]
+# Seconds responses stay fresh, then how long a stale one is served while it's refreshed
+_HOUR = 60 * 60
+_DAY = 24 * _HOUR
+_USERS_TTL = (_HOUR, _DAY)
+_BADGES_TTL = (_DAY, 7 * _DAY)
+_CHANNEL_BADGES_TTL = (_HOUR, _DAY)
+_CHANNEL_EMOTES_TTL = (_HOUR, _DAY)
+_EMOTE_SETS_TTL = (_DAY, 7 * _DAY)
 
-_BASE_URL = "https://api.twitch.tv/helix/"
+
+async def _cached_json(
+    url: str, ttl: tuple[float, float], priority: Priority, **kwargs
+) -> dict:
+    return await cached_json(
+        url, *ttl, fetch=partial(helix_client.fetch, priority=priority), **kwargs
+    )
+
+
+def _headers(app_id: str, oauth_token: str) -> dict:
+    return {
+        "Authorization": f"Bearer {oauth_token}",
+        "Client-Id": app_id,
+    }
 
 
 @dataclass
@@ -59,230 +95,334 @@ class NormalUserColor(enum.StrEnum):
     yellow_green = "#9acd32"
 
 
+def emote_from_helix(emote: dict) -> Emote:
+    """
+    Builds an Emote from an emote object returned by the chat emote endpoints.
+
+    Helix doesn't return dimensions, but twitch emotes are always square, 28px at scale 1.0.
+    """
+    return Emote(
+        name=emote["name"],
+        id=emote["id"],
+        source=EmoteSource.TWITCH,
+        width=28,
+        height=28,
+        animated="animated" in emote.get("format", []),
+    )
+
+
+class BatchError(Exception):
+    """
+    Raised when some chunks of a batched lookup failed. result holds what was fetched.
+    """
+
+    def __init__(self, result: "BatchResult") -> None:
+        super().__init__(
+            f"{len(result.failed)} of {result.chunks} requests failed: "
+            f"{list(result.failed.values())}"
+        )
+        self.result = result
+
+
+@dataclass
+class BatchResult:
+    data: list[dict]
+    # Parameters of every chunk that failed, and why
+    failed: dict[tuple[tuple[str, str], ...], Exception]
+    chunks: int
+
+    def raise_for_failures(self):
+        if self.failed:
+            raise BatchError(self)
+
+
+async def _get_pages(
+    app_id: str,
+    oauth_token: str,
+    endpoint: str,
+    params: list[tuple[str, str]],
+    ttl: tuple[float, float] | None,
+    priority: Priority,
+) -> list[dict]:
+    url = f"{_BASE_URL}{endpoint}"
+    headers = _headers(app_id, oauth_token)
+    data = []
+    cursor = None
+
+    while True:
+        page_params = urlencode(params + ([("after", cursor)] if cursor else []))
+
+        if ttl:
+            json_result = await _cached_json(
+                url, ttl, priority, params=page_params, headers=headers
+            )
+        else:
+            status, _, json_result = await helix_client.fetch(
+                "GET", url, page_params, headers, priority=priority
+            )
+
+            if status != 200:
+                raise ResponseError(status, json_result)
+
+        data += json_result["data"]
+
+        if not (cursor := json_result.get("pagination", {}).get("cursor")):
+            return data
+
+
+async def get_batched(
+    app_id: str,
+    oauth_token: str,
+    endpoint: str,
+    params: Iterable[tuple[str, str | int]],
+    chunk_size: int,
+    ttl: tuple[float, float] | None = None,
+    priority: Priority = Priority.NORMAL,
+    concurrency: int = 4,
+) -> BatchResult:
+    """
+    GETs endpoint with params split into chunks of at most chunk_size, the most the
+    endpoint accepts in one request, and follows the pagination cursor of every chunk.
+
+    At most concurrency chunks are requested at the same time. A failed chunk doesn't
+    stop the others, it's reported in the result's failed dict. Responses are cached for
+    ttl, if given.
+    """
+    # Deduplicated and sorted so the same params always make the same chunks
+    params = sorted({(name, str(value)) for name, value in params})
+    chunks = [params[i : i + chunk_size] for i in range(0, len(params), chunk_size)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get_chunk(chunk: list[tuple[str, str]]):
+        async with semaphore:
+            return await _get_pages(app_id, oauth_token, endpoint, chunk, ttl, priority)
+
+    results = await asyncio.gather(
+        *(get_chunk(chunk) for chunk in chunks), return_exceptions=True
+    )
+
+    result = BatchResult([], {}, len(chunks))
+
+    for chunk, chunk_result in zip(chunks, results):
+        if isinstance(chunk_result, BaseException):
+            if not isinstance(chunk_result, Exception):
+                raise chunk_result
+            result.failed[tuple(chunk)] = chunk_result
+        else:
+            result.data += chunk_result
+
+    if result.failed:
+        logging.warning(
+            f"{len(result.failed)} of {len(chunks)} requests to {endpoint} failed: "
+            f"{list(result.failed.values())}"
+        )
+
+    return result
+
+
 async def get_users(
     app_id: str,
     oauth_token: str,
     users: Iterable[str | int],
+    priority: Priority = Priority.NORMAL,
 ) -> list[TwitchUser]:
     """
-    Raises Exception for invalid status code or KeyError if the json response is invalid
-    """
-    users = "&".join(
-        f"id={user}" if type(user) == int else f"login={user}" for user in users
-    )
-    logging.debug(f"Generated helix get user parameters: {users}")
+    Any number of users can be passed, they're looked up 100 at a time.
 
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    conn = TCPConnector(ssl=ssl_context)
+    Raises BatchError if some of the lookups failed, Exception for invalid status code or
+    KeyError if the json response is invalid
+    """
+    params = [("id", user) if type(user) == int else ("login", user) for user in users]
+    logging.debug(f"Generated helix get user parameters: {params}")
 
-    async with ClientSession(connector=conn) as session:
-        async with session.get(
+    if not params:
+        # The authenticated user, can't be shared between accounts through the cache
+        status, _, json_result = await helix_client.fetch(
+            "GET",
             f"{_BASE_URL}users",
-            headers={
-                "Authorization": f"Bearer {oauth_token}",
-                "Client-Id": app_id,
-            },
-            params=users,
-        ) as response:
-            json_result = await response.json()
-            logging.debug(f"Helix get user response: {json_result}")
+            headers=_headers(app_id, oauth_token),
+            priority=priority,
+        )
+        logging.debug(f"Helix get user response: {json_result}")
 
-            if response.status != 200:
-                raise Exception("Unable to get user")
+        if status != 200:
+            raise Exception("Unable to get user")
 
-            return [TwitchUser(user) for user in json_result["data"]]
+        return [TwitchUser(user) for user in json_result["data"]]
+
+    result = await get_batched(
+        app_id, oauth_token, "users", params, 100, _USERS_TTL, priority
+    )
+    result.raise_for_failures()
+
+    logging.debug(f"Helix get user response: {result.data}")
+    return [TwitchUser(user) for user in result.data]
 
 
 async def get_user_chat_color(
     app_id: str,
     oauth_token: str,
     user_ids: Iterable[int],
+    priority: Priority = Priority.NORMAL,
 ) -> list[UserChatColor]:
     """
-    Raises Exception for invalid status code or KeyError if the json response is invalid
-    """
-    ids = "&".join(f"user_id={user_id}" for user_id in user_ids)
-    logging.debug(f"Generated helix get user id parameters: {ids}")
-
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    conn = TCPConnector(ssl=ssl_context)
+    Any number of users can be passed, they're looked up 100 at a time.
 
-    async with ClientSession(connector=conn) as session:
-        async with session.get(
-            f"{_BASE_URL}chat/color",
-            headers={
-                "Authorization": f"Bearer {oauth_token}",
-                "Client-Id": app_id,
-            },
-            params=ids,
-        ) as response:
-            json_result = await response.json()
-            logging.debug(f"Helix get user response: {json_result}")
+    Raises BatchError if some of the lookups failed or KeyError if the json response is
+    invalid
+    """
+    params = [("user_id", user_id) for user_id in user_ids]
+    logging.debug(f"Generated helix get user id parameters: {params}")
 
-            if response.status != 200:
-                raise Exception("Unable to get user chat color")
+    result = await get_batched(
+        app_id, oauth_token, "chat/color", params, 100, priority=priority
+    )
+    result.raise_for_failures()
 
-            return [UserChatColor(user) for user in json_result["data"]]
+    logging.debug(f"Helix get user response: {result.data}")
+    return [UserChatColor(user) for user in result.data]
 
 
 async def update_chat_color(
-    app_id: str, oauth_token: str, user_id: str, color_code: str | NormalUserColor
+    app_id: str,
+    oauth_token: str,
+    user_id: str,
+    color_code: str | NormalUserColor,
+    priority: Priority = Priority.HIGH,
 ) -> bool:
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    conn = TCPConnector(ssl=ssl_context)
-
-    async with ClientSession(connector=conn) as session:
-        params = {
-            "user_id": user_id,
-            "color": str(color_code),
-        }
-        async with session.put(
-            f"{_BASE_URL}chat/color",
-            headers={
-                "Authorization": f"Bearer {oauth_token}",
-                "Client-Id": app_id,
-            },
-            params=params,
-        ) as response:
-            logging.debug(
-                f"Helix tried changing user color, response code: {response.status}. Params: {params}"
-            )
-            return response.status == 204
+    params = {
+        "user_id": user_id,
+        "color": str(color_code),
+    }
+    status, *_ = await helix_client.fetch(
+        "PUT",
+        f"{_BASE_URL}chat/color",
+        params=params,
+        headers=_headers(app_id, oauth_token),
+        priority=priority,
+    )
+    logging.debug(
+        f"Helix tried changing user color, response code: {status}. Params: {params}"
+    )
+    return status == 204
 
 
 async def get_global_badges(
     app_id: str,
     oauth_token: str,
+    priority: Priority = Priority.NORMAL,
 ) -> dict:
     """
     Raises Exception for invalid status code
     """
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    conn = TCPConnector(ssl=ssl_context)
-
-    async with ClientSession(connector=conn) as session:
-        async with session.get(
+    try:
+        json_result = await _cached_json(
             f"{_BASE_URL}chat/badges/global",
-            headers={
-                "Authorization": f"Bearer {oauth_token}",
-                "Client-Id": app_id,
-            },
-        ) as response:
-            json_result = await response.json()
-            logging.debug(f"Helix get global badge response: {json_result}")
-
-            if response.status != 200:
-                raise Exception("Unable to get global badges")
+            _BADGES_TTL,
+            priority,
+            headers=_headers(app_id, oauth_token),
+        )
+    except ResponseError as e:
+        raise Exception("Unable to get global badges") from e
 
-            return json_result["data"]
+    logging.debug(f"Helix get global badge response: {json_result}")
+    return json_result["data"]
 
 
-async def get_channel_emotes(app_id: str, oauth_token: str, broadcaster_id: str):
+async def get_channel_badges(
+    app_id: str,
+    oauth_token: str,
+    broadcaster_id: str,
+    priority: Priority = Priority.NORMAL,
+) -> list[dict]:
     """
+    Subscriber and bits badges of the channel, which replace the global sets of the same
+    id in its chat.
+
     Raises Exception for invalid status code
     """
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    conn = TCPConnector(ssl=ssl_context)
+    try:
+        json_result = await _cached_json(
+            f"{_BASE_URL}chat/badges",
+            _CHANNEL_BADGES_TTL,
+            priority,
+            params=f"broadcaster_id={broadcaster_id}",
+            headers=_headers(app_id, oauth_token),
+        )
+    except ResponseError as e:
+        raise Exception(
+            f"Unable to get channel badges for {broadcaster_id} with response {e.body}"
+        ) from e
+
+    logging.debug(f"Helix get channel badges response: {json_result}")
+    return json_result["data"]
 
-    async with ClientSession(connector=conn) as session:
-        async with session.get(
+
+async def get_channel_emotes(
+    app_id: str,
+    oauth_token: str,
+    broadcaster_id: str,
+    priority: Priority = Priority.NORMAL,
+):
+    """
+    Raises Exception for invalid status code
+    """
+    try:
+        json_result = await _cached_json(
             f"{_BASE_URL}chat/emotes",
-            headers={
-                "Authorization": f"Bearer {oauth_token}",
-                "Client-Id": app_id,
-            },
+            _CHANNEL_EMOTES_TTL,
+            priority,
             params=f"broadcaster_id={broadcaster_id}",
-        ) as response:
-            json_result = await response.json()
-            logging.debug(f"Helix get channel emotes response: {json_result}")
-
-            if not response.ok:
-                raise Exception(
-                    f"Unable to get channel emotes for {broadcaster_id} with response {json_result}"
-                )
+            headers=_headers(app_id, oauth_token),
+        )
+    except ResponseError as e:
+        raise Exception(
+            f"Unable to get channel emotes for {broadcaster_id} with response {e.body}"
+        ) from e
 
-            return json_result["data"]
+    logging.debug(f"Helix get channel emotes response: {json_result}")
+    return json_result["data"]
 
 
 async def get_emote_sets(
-    app_id: str, oauth_token: str, emote_set_ids: set[str]
+    app_id: str,
+    oauth_token: str,
+    emote_set_ids: set[str],
+    priority: Priority = Priority.NORMAL,
 ) -> list[dict]:
     """
     Returns a list of dicts where each key-value pair is the information for an emote.
 
     Raises Exception for invalid status code or passing more than 25 set ids
     """
-    if not emote_set_ids:
-        return []
-
     if len(emote_set_ids) > 25:
         raise Exception("You may specify a maximum of 25 IDs.")
 
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    conn = TCPConnector(ssl=ssl_context)
-
-    ids = "&".join(f"emote_set_id={user_id}" for user_id in emote_set_ids)
-    logging.debug(f"Generated params for emote sets query: {ids}")
+    result = await get_all_emote_sets(app_id, oauth_token, emote_set_ids, priority)
 
-    async with ClientSession(connector=conn) as session:
-        async with session.get(
-            f"{_BASE_URL}chat/emotes/set",
-            headers={
-                "Authorization": f"Bearer {oauth_token}",
-                "Client-Id": app_id,
-            },
-            params=ids,
-        ) as response:
-            json_result = await response.json()
-            logging.debug(f"Helix get channel emotes response: {json_result}")
+    if result.failed:
+        raise Exception(
+            f"Unable to get emote sets {','.join(emote_set_ids)}"
+        ) from next(iter(result.failed.values()))
 
-            if not response.ok:
-                raise Exception(
-                    f"Unable to get emote sets {','.join(emote_set_ids)} with response {json_result}"
-                )
-
-            return json_result["data"]
+    return result.data
 
 
 async def get_all_emote_sets(
-    app_id: str, oauth_token: str, emote_set_ids: set[str]
-) -> list[dict]:
+    app_id: str,
+    oauth_token: str,
+    emote_set_ids: set[str],
+    priority: Priority = Priority.NORMAL,
+) -> BatchResult:
     """
     Instead of thowing an exception when the number of emote_set_ids exceeds 25
-    like get_emote_sets, this function tries to get all the emote sets by turning
-    the ids into batches of 25 and requesting for each batch concurrently.
+    like get_emote_sets, this function gets all the emote sets 25 at a time.
 
-    Returns a list of dicts where each key-value pair is the information for an emote.
+    Returns the emotes as dicts, along with the sets that couldn't be fetched.
     """
+    params = [("emote_set_id", set_id) for set_id in emote_set_ids]
+    logging.debug(f"Generated params for emote sets query: {params}")
 
-    def batched(iterable, n):
-        """
-        batched('ABCDEFG', 3) --> ABC DEF G
-
-        Taken from python 3.12 itertools(not officially in 3.11)
-        """
-        if n < 1:
-            raise ValueError("n must be at least one")
-        it = iter(iterable)
-        while batch := tuple(itertools.islice(it, n)):
-            yield batch
-
-    emote_tasks = []
-    emote_sets = []
-
-    try:
-        async with asyncio.timeout(5):
-            for batch in batched(emote_set_ids, 25):
-                task = asyncio.create_task(
-                    get_emote_sets(app_id, oauth_token, set(batch))
-                )
-                emote_tasks.append(task)
-
-            for task in asyncio.as_completed(emote_tasks):
-                emote_sets += await task
-    except Exception as e:
-        logging.warning(
-            f"Returning incomplete set of emotes {emote_sets} because of exception {e}"
-        )
-
-    return emote_sets
+    return await get_batched(
+        app_id, oauth_token, "chat/emotes/set", params, 25, _EMOTE_SETS_TTL, priority
+    )
@@ -0,0 +1,279 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Mapping
+from urllib.parse import urlencode, urlsplit
+
+from hasherino.api import http_client
+
+__all__ = ["Priority", "EndpointStats", "HelixClient", "fetch", "get_stats"]
+
+# Upper bounds, in seconds, of the latency histogram buckets. The last bucket is unbounded
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Priority(enum.IntEnum):
+    """
+    Order in which requests waiting on the rate limit are sent, lowest first.
+    """
+
+    HIGH = 0  # Something the user just did is waiting on it
+    NORMAL = 1
+    LOW = 2  # Prefetching, nothing is waiting on it yet
+
+
+@dataclass
+class EndpointStats:
+    calls: int = 0
+    coalesced: int = 0
+    retries: int = 0
+    errors: int = 0
+    latency_histogram: list[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+
+    def record_latency(self, seconds: float):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_histogram[i] += 1
+                return
+
+        self.latency_histogram[-1] += 1
+
+
+class _RateLimiter:
+    """
+    Token bucket mirroring the one helix reports in the Ratelimit-* headers.
+
+    Requests take a point before being sent. Once the bucket is empty they wait, by
+    priority, until it's refilled at the reset time.
+    """
+
+    def __init__(self, limit: int = 800) -> None:
+        self.limit = limit
+        self.remaining = limit
+        self.reset_at = 0.0
+
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wake_handle: asyncio.TimerHandle | None = None
+
+    def _take(self) -> bool:
+        if self.remaining <= 0 and time.time() >= self.reset_at:
+            self.remaining = self.limit
+
+        if self.remaining > 0:
+            self.remaining -= 1
+            return True
+
+        return False
+
+    async def acquire(self, priority: Priority):
+        if not self._waiters and self._take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        logging.debug(
+            f"Helix rate limit reached, {len(self._waiters)} requests waiting"
+        )
+        self._release()
+        await future
+
+    def update(self, headers: Mapping[str, str]):
+        """
+        Syncs the bucket with the one reported in the response headers.
+        """
+        try:
+            self.limit = int(headers.get("Ratelimit-Limit", self.limit))
+            self.remaining = int(headers.get("Ratelimit-Remaining", self.remaining))
+            self.reset_at = float(headers.get("Ratelimit-Reset", self.reset_at))
+        except ValueError:
+            logging.warning(f"Invalid helix rate limit headers: {headers}")
+
+        self._release()
+
+    def empty(self, reset_at: float):
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, reset_at)
+
+    def _release(self):
+        while self._waiters:
+            *_, future = self._waiters[0]
+
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+            elif self._take():
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+            else:
+                break
+
+        if self._wake_handle is not None:
+            self._wake_handle.cancel()
+            self._wake_handle = None
+
+        if self._waiters:
+            self._wake_handle = asyncio.get_running_loop().call_later(
+                max(self.reset_at - time.time(), 0.1), self._release
+            )
+
+
+class HelixClient:
+    """
+    Sends helix requests through the shared session.
+
+    Identical GET requests in flight at the same time are merged into one. Every request
+    waits for the rate limit bucket, and 429 or 5xx responses are retried with
+    exponential backoff.
+    """
+
+    def __init__(
+        self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats: dict[str, EndpointStats] = {}
+
+        # All requests are made with the user's token, so they share one bucket
+        self._rate_limiter = _RateLimiter()
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _endpoint(url: str) -> str:
+        return urlsplit(url).path.removeprefix("/helix/")
+
+    @staticmethod
+    def _key(method: str, url: str, params, headers: dict, body) -> str:
+        if isinstance(params, dict):
+            params = urlencode(sorted(params.items()))
+
+        return json.dumps(
+            [method, url, params, sorted(headers.items()), body], sort_keys=True
+        )
+
+    async def fetch(
+        self,
+        method: str,
+        url: str,
+        params: str | dict | None = None,
+        headers: dict | None = None,
+        body=None,
+        priority: Priority = Priority.NORMAL,
+    ) -> tuple[int, Mapping[str, str], object]:
+        """
+        Returns the status, headers and JSON body of the response. The body is None if
+        the response doesn't have one.
+        """
+        headers = headers or {}
+        stats = self.stats.setdefault(self._endpoint(url), EndpointStats())
+
+        if method != "GET":
+            return await self._send(method, url, params, headers, body, priority, stats)
+
+        key = self._key(method, url, params, headers, body)
+
+        if key in self._in_flight:
+            stats.coalesced += 1
+            logging.debug(f"Joining in-flight helix request to {url}")
+        else:
+            self._in_flight[key] = asyncio.ensure_future(
+                self._send(method, url, params, headers, body, priority, stats)
+            )
+            self._in_flight[key].add_done_callback(
+                lambda _: self._in_flight.pop(key, None)
+            )
+
+        # Shielded so a caller giving up doesn't cancel the request for everyone else
+        return await asyncio.shield(self._in_flight[key])
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.base_delay * 2**attempt, self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        params,
+        headers: dict,
+        body,
+        priority: Priority,
+        stats: EndpointStats,
+    ):
+        for attempt in itertools.count():
+            await self._rate_limiter.acquire(priority)
+
+            stats.calls += 1
+            start = time.perf_counter()
+
+            try:
+                async with http_client.get_session().request(
+                    method, url, params=params, headers=headers, json=body
+                ) as response:
+                    self._rate_limiter.update(response.headers)
+
+                    if response.content_length == 0 or response.status in (204, 304):
+                        result = None
+                    else:
+                        result = await response.json(content_type=None)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.record_latency(time.perf_counter() - start)
+
+            retry = response.status == 429 or response.status >= 500
+
+            if not retry or attempt >= self.max_retries:
+                if response.status >= 400:
+                    stats.errors += 1
+                return response.status, response.headers, result
+
+            stats.retries += 1
+
+            if response.status == 429:
+                # The bucket is empty until the reset time, the rate limiter waits for it
+                self._rate_limiter.empty(time.time() + self._backoff(attempt))
+                delay = 0
+                wait = self._rate_limiter.reset_at - time.time()
+            else:
+                delay = wait = self._backoff(attempt)
+
+            logging.warning(
+                f"Helix responded {response.status} to {method} {url}, "
+                f"retry {attempt + 1} of {self.max_retries} in {wait:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+
+_client = HelixClient()
+
+
+async def fetch(
+    method: str,
+    url: str,
+    params: str | dict | None = None,
+    headers: dict | None = None,
+    body=None,
+    priority: Priority = Priority.NORMAL,
+):
+    """
+    HelixClient.fetch on the client shared by the helix API functions.
+    """
+    return await _client.fetch(method, url, params, headers, body, priority)
+
+
+def get_stats() -> dict[str, EndpointStats]:
+    """
+    Per endpoint request statistics of the shared client.
+    """
+    return _client.stats
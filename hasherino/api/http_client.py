@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import ssl
+from functools import cache
+
+import certifi
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+__all__ = ["get_ssl_context", "configure", "get_session", "warm_up", "close"]
+
+# Hosts the app talks to right after starting
+MAIN_HOSTS = (
+    "https://api.twitch.tv",
+    "https://id.twitch.tv",
+    "https://7tv.io",
+    "https://cdn.7tv.app",
+    "https://static-cdn.jtvnw.net",
+    "https://recent-messages.robotty.de",
+)
+
+_config = {
+    "total_timeout": 30.0,
+    "connect_timeout": 10.0,
+    "limit": 100,
+    "limit_per_host": 8,
+    "keepalive_timeout": 60.0,
+}
+_session: ClientSession | None = None
+
+
+@cache
+def get_ssl_context() -> ssl.SSLContext:
+    """
+    SSL context trusting certifi's CA bundle, built once since loading the bundle is slow.
+    """
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+def configure(
+    total_timeout: float | None = None,
+    connect_timeout: float | None = None,
+    limit: int | None = None,
+    limit_per_host: int | None = None,
+    keepalive_timeout: float | None = None,
+):
+    """
+    Changes the settings of the shared session. Only affects sessions created after the
+    call, so it should be called before the first request.
+    """
+    for key, value in locals().copy().items():
+        if value is not None:
+            _config[key] = value
+
+
+def get_session() -> ClientSession:
+    """
+    Application-wide session, connections are kept alive and reused between requests.
+    """
+    global _session
+
+    if _session is None or _session.closed:
+        connector = TCPConnector(
+            ssl=get_ssl_context(),
+            limit=_config["limit"],
+            limit_per_host=_config["limit_per_host"],
+            keepalive_timeout=_config["keepalive_timeout"],
+            ttl_dns_cache=300,
+        )
+        _session = ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(
+                total=_config["total_timeout"], connect=_config["connect_timeout"]
+            ),
+        )
+
+    return _session
+
+
+async def _open_connection(url: str):
+    try:
+        async with get_session().head(url, allow_redirects=False) as response:
+            logging.debug(f"Warmed up connection to {url}: {response.status}")
+    except Exception as e:
+        logging.debug(f"Failed to warm up connection to {url}: {e}")
+
+
+async def warm_up(urls: tuple[str, ...] = MAIN_HOSTS):
+    """
+    Opens connections to urls ahead of the first real request, so DNS, TCP and TLS
+    handshakes are already done when it's made.
+    """
+    await asyncio.gather(*(_open_connection(url) for url in urls))
+
+
+async def close():
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+    _session = None
@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Mapping
+from urllib.parse import urlencode
+
+from hasherino.api import http_client
+from hasherino.storage import AsyncKeyValueStorage
+
+__all__ = ["ResponseError", "ResponseCache", "load", "cached_json"]
+
+# (method, url, params, headers, body) -> (status, headers, JSON body or None)
+Fetch = Callable[..., Awaitable[tuple[int, Mapping[str, str], Any]]]
+
+
+class ResponseError(Exception):
+    def __init__(self, status: int, body) -> None:
+        super().__init__(f"Response status {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+async def _fetch_json(method: str, url: str, params, headers: dict, body):
+    async with http_client.get_session().request(
+        method, url, params=params, headers=headers, json=body
+    ) as response:
+        result = None if response.status == 304 else await response.json()
+        return response.status, response.headers, result
+
+
+class ResponseCache:
+    """
+    Cache of JSON API responses, optionally persisted to a storage namespace.
+
+    Each request says for how long its response is fresh (ttl) and for how much longer a
+    stale response may still be served while it's refreshed in the background
+    (stale_ttl). Responses with an ETag are revalidated with If-None-Match, so an
+    unchanged response costs a 304 instead of the whole body. Least recently used
+    responses are evicted once the cached bodies take more than max_size bytes.
+    """
+
+    def __init__(self, max_size: int = 10 * 1024 * 1024) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+        self._storage: AsyncKeyValueStorage | None = None
+        # Key -> {"url", "body", "etag", "fetched_at", "last_access", "size"}
+        self._entries: dict[str, dict] = {}
+        self._total_size = 0
+        self._refreshing: dict[str, asyncio.Task] = {}
+
+    async def load(self, storage: AsyncKeyValueStorage):
+        """
+        Reads persisted responses from storage and persists new ones to it.
+        """
+        self._storage = storage
+        self._entries = dict(await storage.range())
+        self._total_size = sum(entry["size"] for entry in self._entries.values())
+
+        logging.info(
+            f"Loaded {len(self._entries)} cached responses, {self._total_size} bytes"
+        )
+        await self._evict()
+
+    @staticmethod
+    def _key(method: str, url: str, params: str | dict | None, body) -> str:
+        if isinstance(params, dict):
+            params = urlencode(sorted(params.items()))
+
+        request = f"{method} {url}?{params or ''} {json.dumps(body, sort_keys=True)}"
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    async def get_json(
+        self,
+        url: str,
+        ttl: float,
+        stale_ttl: float = 0,
+        method: str = "GET",
+        params: str | dict | None = None,
+        headers: dict | None = None,
+        body=None,
+        cacheable: Callable[[Any], bool] | None = None,
+        fetch: Fetch | None = None,
+    ):
+        """
+        Returns the JSON response for the request, from the cache when possible.
+
+        Raises ResponseError for unsuccessful responses, which are never cached, neither are
+        responses cacheable returns False for. If the request fails and there's a cached
+        response, it's returned however old it is. The request is made with fetch, a plain
+        request through the shared session by default.
+        """
+        request = (method, url, params, headers, body, cacheable, fetch or _fetch_json)
+        key = self._key(method, url, params, body)
+        entry = self._entries.get(key)
+        now = time.time()
+
+        if entry:
+            entry["last_access"] = now
+            age = now - entry["fetched_at"]
+
+            if age < ttl:
+                self.hits += 1
+                return entry["body"]
+
+            if age < ttl + stale_ttl:
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    self._refreshing[key] = asyncio.create_task(
+                        self._fetch(key, *request)
+                    )
+                    self._refreshing[key].add_done_callback(
+                        lambda task: self._refresh_done(key, url, task)
+                    )
+                return entry["body"]
+
+        self.misses += 1
+
+        try:
+            return await self._fetch(key, *request)
+        except Exception as e:
+            if entry is None or isinstance(e, ResponseError):
+                raise
+
+            logging.warning(f"Serving expired response for {url}, refresh failed: {e}")
+            return entry["body"]
+
+    def _refresh_done(self, key: str, url: str, task: asyncio.Task):
+        self._refreshing.pop(key, None)
+
+        if not task.cancelled() and (e := task.exception()):
+            logging.warning(f"Background refresh of {url} failed: {e}")
+
+    async def _fetch(
+        self,
+        key: str,
+        method: str,
+        url: str,
+        params,
+        headers,
+        body,
+        cacheable,
+        fetch: Fetch,
+    ):
+        headers = dict(headers or {})
+        entry = self._entries.get(key)
+
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+
+        status, response_headers, result = await fetch(
+            method, url, params, headers, body
+        )
+
+        if status == 304 and "If-None-Match" in headers:
+            if self._entries.get(key) is entry:
+                self.revalidated += 1
+                logging.debug(f"Cached response for {url} is still valid")
+                entry["fetched_at"] = time.time()
+                await self._save(key, entry)
+                return entry["body"]
+
+            # Evicted or replaced meanwhile, the 304 may not be about what is cached now
+            logging.debug(f"Cached response for {url} is gone, fetching it again")
+            del headers["If-None-Match"]
+            status, response_headers, result = await fetch(
+                method, url, params, headers, body
+            )
+
+        if not 200 <= status < 300:
+            raise ResponseError(status, result)
+
+        etag = response_headers.get("ETag")
+
+        if cacheable and not cacheable(result):
+            logging.debug(f"Not caching response for {url}")
+            return result
+
+        size = len(json.dumps(result))
+        if old := self._entries.get(key):
+            self._total_size -= old["size"]
+
+        entry = {
+            "url": url,
+            "body": result,
+            "etag": etag,
+            "fetched_at": time.time(),
+            "last_access": time.time(),
+            "size": size,
+        }
+        self._entries[key] = entry
+        self._total_size += size
+        logging.debug(f"Cached response for {url}, {size} bytes")
+
+        await self._save(key, entry)
+        await self._evict()
+
+        return result
+
+    async def _save(self, key: str, entry: dict):
+        if self._storage:
+            await self._storage.set(key, entry)
+
+    async def _evict(self):
+        if self._total_size <= self.max_size:
+            return
+
+        evicted = []
+
+        for key, entry in sorted(
+            self._entries.items(), key=lambda item: item[1]["last_access"]
+        ):
+            if self._total_size <= self.max_size:
+                break
+
+            self._total_size -= entry["size"]
+            evicted.append(key)
+
+        for key in evicted:
+            del self._entries[key]
+
+        if self._storage:
+            async with self._storage.transaction() as transaction:
+                for key in evicted:
+                    await transaction.remove(key)
+
+        logging.debug(f"Evicted {len(evicted)} cached responses")
+
+
+_cache = ResponseCache()
+
+
+async def load(storage: AsyncKeyValueStorage):
+    """
+    Persists the shared response cache to storage, loading what's already there.
+    """
+    await _cache.load(storage)
+
+
+async def cached_json(url: str, ttl: float, stale_ttl: float = 0, **kwargs):
+    """
+    ResponseCache.get_json on the cache shared by the API clients.
+    """
+    return await _cache.get_json(url, ttl, stale_ttl, **kwargs)
@@ -1,112 +1,171 @@
-import ssl
+import asyncio
 
-import certifi
-from aiohttp import ClientSession, TCPConnector
+from hasherino.api.response_cache import cached_json
+from hasherino.hasherino_dataclasses import Emote, EmoteSource
+
+
+def emote_from_gql(emote: dict) -> Emote:
+    """
+    Builds an Emote from an emote object returned by the gql api, dimensions are taken
+    from the 1x file of the emote's host.
+    """
+    data = emote.get("data") or {}
+    files = (data.get("host") or {}).get("files") or []
+    size_1x = next((file for file in files if file["name"].startswith("1x")), {})
+
+    return Emote(
+        name=emote["name"],
+        id=data.get("id", emote["id"]),
+        source=EmoteSource.SEVENTV,
+        width=size_1x.get("width"),
+        height=size_1x.get("height"),
+        animated=bool(data.get("animated")),
+    )
+
+
+# Seconds responses stay fresh, then how long a stale one is served while it's refreshed
+_USER_TTL = (5 * 60, 24 * 60 * 60)
+# Always refetched, live updates only cover changes made while the set is followed. The
+# cached response is only served when 7tv can't be reached
+_EMOTE_SET_TTL = (0, 0)
+_GLOBAL_EMOTE_SET_TTL = (60 * 60, 7 * 24 * 60 * 60)
+
+# Emote fields read by emote_from_gql, dimensions come from the host's files
+_EMOTES_FIELDS = """
+    emotes {
+        id
+        name
+        data {
+            id
+            animated
+            host {
+                files {
+                    name
+                    width
+                    height
+                }
+            }
+        }
+    }"""
 
 
 class SevenTV:
+    # Global emote set, shared by every tab
     _EMOTES = {}
+    _EMOTES_LOCK = asyncio.Lock()
 
     @staticmethod
-    def _get_client_session() -> ClientSession:
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        conn = TCPConnector(ssl=ssl_context)
-        return ClientSession(connector=conn)
-
-    @staticmethod
-    async def _gql_request(query: dict):
-        async with SevenTV._get_client_session() as session:
-            async with session.post(
+    async def _gql_request(query: dict, ttl: tuple[float, float] = (0, 0)):
+        """
+        ttl is how long the response stays fresh and how long it may be served stale.
+        """
+        return (
+            await cached_json(
                 "https://7tv.io/v3/gql",
+                *ttl,
+                method="POST",
                 headers={
                     "Content-Type": "application/json",
                 },
-                json=query,
-            ) as response:
-                return (await response.json())["data"]
+                body=query,
+                # GQL errors come with a 200 status, don't keep them around
+                cacheable=lambda result: not result.get("errors"),
+            )
+        )["data"]
 
     @staticmethod
-    async def get_user(ttv_user_id: str):
-        return (
+    async def get_user_emote_set_id(ttv_user_id: str) -> str | None:
+        """
+        Id of the emote set the user has active on twitch, None if they don't have a 7tv
+        account or set.
+        """
+        user = (
             await SevenTV._gql_request(
                 {
                     "operationName": "GetUserByConnection",
                     "query": """
                         query GetUserByConnection($platform: ConnectionPlatform! $id: String!) {
                             userByConnection (platform: $platform id: $id) {
-                                id
-                                type
-                                username
-                                roles
-                                created_at
                                 connections {
-                                    id
                                     platform
                                     emote_set_id
                                 }
-                                editors {
-                                  user {
-                                    id
-                                    username
-                                  }
-                                }
-                                emote_sets {
-                                    id
-                                    emotes {
-                                        id
-                                        name
-                                        data {
-                                          id
-                                          name
-                                        }
-                                    }
-                                    capacity
-                                }
                             }
                         }""",
                     "variables": {
                         "platform": "TWITCH",
                         "id": ttv_user_id,
                     },
-                }
+                },
+                _USER_TTL,
             )
         )["userByConnection"]
 
-    @staticmethod
-    async def get_global_emote_set() -> dict:
-        if SevenTV._EMOTES:
-            return SevenTV._EMOTES
+        if not user:
+            return None
+
+        return next(
+            (
+                connection["emote_set_id"]
+                for connection in user["connections"]
+                if connection["platform"] == "TWITCH"
+            ),
+            None,
+        )
 
+    @staticmethod
+    async def get_emote_set(emote_set_id: str) -> dict:
+        """
+        The set's id and its emotes, with only the fields emote_from_gql reads.
+        """
         return (
             await SevenTV._gql_request(
                 {
-                    "operationName": "AppState",
-                    "query": """
-                        query AppState {
-                          globalEmoteSet: namedEmoteSet(name: GLOBAL) {
-                            id
-                            name
-                            emotes {
-                              id
-                              name
-                              flags
-                              __typename
-                            }
-                            capacity
-                            __typename
-                          }
-                          roles: roles {
-                            id
-                            name
-                            allowed
-                            denied
-                            position
-                            color
-                            invisible
-                            __typename
-                          }
-                        }""",
-                    "variables": {},
-                }
+                    "operationName": "GetEmoteSet",
+                    "query": f"""
+                        query GetEmoteSet($id: ObjectID!) {{
+                            emoteSet (id: $id) {{
+                                id
+                                {_EMOTES_FIELDS}
+                            }}
+                        }}""",
+                    "variables": {"id": emote_set_id},
+                },
+                _EMOTE_SET_TTL,
             )
-        )["globalEmoteSet"]
+        )["emoteSet"]
+
+    @staticmethod
+    async def get_active_emote_set(ttv_user_id: str) -> dict | None:
+        if not (emote_set_id := await SevenTV.get_user_emote_set_id(ttv_user_id)):
+            return None
+
+        return await SevenTV.get_emote_set(emote_set_id)
+
+    @staticmethod
+    async def get_global_emote_set() -> dict:
+        """
+        Fetched once per process, the response is also kept on disk by the response cache.
+        """
+        async with SevenTV._EMOTES_LOCK:
+            if SevenTV._EMOTES:
+                return SevenTV._EMOTES
+
+            SevenTV._EMOTES = (
+                await SevenTV._gql_request(
+                    {
+                        "operationName": "GetGlobalEmoteSet",
+                        "query": f"""
+                            query GetGlobalEmoteSet {{
+                                namedEmoteSet (name: GLOBAL) {{
+                                    id
+                                    {_EMOTES_FIELDS}
+                                }}
+                            }}""",
+                        "variables": {},
+                    },
+                    _GLOBAL_EMOTE_SET_TTL,
+                )
+            )["namedEmoteSet"]
+
+            return SevenTV._EMOTES
@@ -0,0 +1,251 @@
+import asyncio
+import enum
+import json
+import logging
+import random
+from collections import Counter
+from typing import Awaitable, Callable
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+from hasherino.api import http_client
+from hasherino.api.seven_tv import emote_from_gql
+from hasherino.hasherino_dataclasses import Emote
+
+__all__ = ["EVENTS_URL", "SevenTVEvents", "apply_emote_set_update"]
+
+EVENTS_URL = "wss://events.7tv.io/v3"
+
+
+class _Opcode(enum.IntEnum):
+    DISPATCH = 0
+    HELLO = 1
+    HEARTBEAT = 2
+    RECONNECT = 4
+    ACK = 5
+    ERROR = 6
+    END_OF_STREAM = 7
+    RESUME = 34
+    SUBSCRIBE = 35
+    UNSUBSCRIBE = 36
+
+
+def apply_emote_set_update(
+    emotes: dict[str, Emote], body: dict, fallback: dict[str, Emote] | None = None
+) -> bool:
+    """
+    Applies the changes of an emote_set.update event to emotes, a name to emote map.
+    Removed emotes are replaced by the fallback emote of the same name, if there is one,
+    like a global emote the removed one shadowed. Returns whether any emote changed.
+    """
+    changed = False
+
+    def remove(old: dict):
+        nonlocal changed
+        # Only if it's still the same emote, the name may be taken by another one now
+        if (emote := emotes.get(old["name"])) and emote.id in (
+            old["id"],
+            (old.get("data") or {}).get("id"),
+        ):
+            if fallback and old["name"] in fallback:
+                emotes[old["name"]] = fallback[old["name"]]
+            else:
+                del emotes[old["name"]]
+            changed = True
+
+    def add(new: dict):
+        nonlocal changed
+        emotes[new["name"]] = emote_from_gql(new)
+        changed = True
+
+    for change in body.get("pulled") or []:
+        if change.get("key") == "emotes" and change.get("old_value"):
+            remove(change["old_value"])
+
+    for change in body.get("updated") or []:
+        if change.get("key") == "emotes" and change.get("value"):
+            # Renames come as updates with the old and new emote
+            if change.get("old_value"):
+                remove(change["old_value"])
+            add(change["value"])
+
+    for change in body.get("pushed") or []:
+        if change.get("key") == "emotes" and change.get("value"):
+            add(change["value"])
+
+    return changed
+
+
+class SevenTVEvents:
+    """
+    Client of the 7TV event API, receives changes to subscribed emote sets as they happen.
+
+    on_emote_set_update is called with the emote set id and the body of every
+    emote_set.update event. Dropped connections are reconnected with exponential backoff,
+    resuming the session so events sent meanwhile are replayed.
+    """
+
+    def __init__(
+        self,
+        on_emote_set_update: Callable[[str, dict], Awaitable],
+        url: str = EVENTS_URL,
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.on_emote_set_update = on_emote_set_update
+        self.url = url
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        # Emote set id -> number of subscribers, a set can be used by several channels
+        self._subscriptions: Counter[str] = Counter()
+        # Subscriptions the server knows of in the current session
+        self._active: set[str] = set()
+        self._websocket = None
+        self._session_id: str | None = None
+        self._heartbeat_interval = 45.0
+        self._backoff = min_backoff
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def subscribe(self, emote_set_id: str):
+        self._subscriptions[emote_set_id] += 1
+        await self._sync_subscriptions()
+
+    async def unsubscribe(self, emote_set_id: str):
+        """
+        Drops one subscription to the emote set, it's only unsubscribed from once none are
+        left.
+        """
+        if self._subscriptions[emote_set_id] <= 1:
+            del self._subscriptions[emote_set_id]
+        else:
+            self._subscriptions[emote_set_id] -= 1
+
+        await self._sync_subscriptions()
+
+    async def _send(self, op: _Opcode, data: dict):
+        await self._websocket.send(json.dumps({"op": op, "d": data}))
+
+    async def _sync_subscriptions(self):
+        """
+        Sends the subscription changes made since the session's last sync, if connected.
+        """
+        if self._websocket is None or self._session_id is None:
+            return
+
+        for op, emote_set_ids in (
+            (_Opcode.SUBSCRIBE, self._subscriptions.keys() - self._active),
+            (_Opcode.UNSUBSCRIBE, self._active - self._subscriptions.keys()),
+        ):
+            for emote_set_id in emote_set_ids:
+                await self._send(
+                    op,
+                    {
+                        "type": "emote_set.update",
+                        "condition": {"object_id": emote_set_id},
+                    },
+                )
+
+        self._active = set(self._subscriptions)
+
+    async def run(self):
+        """
+        Keeps a connection open until cancelled.
+        """
+        while True:
+            try:
+                async with websockets.connect(
+                    self.url,
+                    ssl=http_client.get_ssl_context()
+                    if self.url.startswith("wss://")
+                    else None,
+                ) as websocket:
+                    self._websocket = websocket
+                    await self._listen(websocket)
+            except asyncio.CancelledError:
+                raise
+            except ConnectionClosed as e:
+                logging.info(f"7TV event connection closed: {e}")
+            except Exception as e:
+                logging.warning(f"7TV event connection failed: {e}")
+            finally:
+                self._websocket = None
+
+            delay = random.uniform(self._backoff / 2, self._backoff)
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+            logging.info(f"Reconnecting to 7TV events in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _listen(self, websocket):
+        while True:
+            # The server sends heartbeats, missing a few means the connection is gone
+            raw = await asyncio.wait_for(
+                websocket.recv(), timeout=self._heartbeat_interval * 3
+            )
+            message = json.loads(raw)
+            data = message.get("d") or {}
+
+            match message.get("op"):
+                case _Opcode.HELLO:
+                    await self._on_hello(data)
+                case _Opcode.DISPATCH:
+                    await self._on_dispatch(data)
+                case _Opcode.ACK:
+                    await self._on_ack(data)
+                case _Opcode.HEARTBEAT:
+                    pass
+                case _Opcode.RECONNECT | _Opcode.END_OF_STREAM:
+                    logging.info(f"7TV event server closing the connection: {data}")
+                    return
+                case _Opcode.ERROR:
+                    logging.warning(f"7TV event error: {data}")
+                case op:
+                    logging.debug(f"Unhandled 7TV event opcode {op}: {data}")
+
+    async def _on_hello(self, data: dict):
+        self._heartbeat_interval = data.get("heartbeat_interval", 45000) / 1000
+        previous_session, self._session_id = self._session_id, data.get("session_id")
+        logging.info(f"Connected to 7TV events, session {self._session_id}")
+        # Connected successfully, start over if it drops again
+        self._backoff = self.min_backoff
+
+        if previous_session:
+            # Subscriptions are synced once the server says whether it worked
+            await self._send(_Opcode.RESUME, {"session_id": previous_session})
+        else:
+            self._active = set()
+            await self._sync_subscriptions()
+
+    async def _on_ack(self, data: dict):
+        if data.get("command") != "RESUME":
+            return
+
+        if (data.get("data") or {}).get("success"):
+            logging.info(f"Resumed 7TV event session: {data}")
+        else:
+            # New session, nothing is subscribed on it
+            self._active = set()
+
+        await self._sync_subscriptions()
+
+    async def _on_dispatch(self, data: dict):
+        if data.get("type") != "emote_set.update":
+            return
+
+        body = data.get("body") or {}
+        logging.debug(f"7TV emote set update: {body}")
+
+        try:
+            await self.on_emote_set_update(body.get("id"), body)
+        except Exception as e:
+            logging.exception(f"Failed to apply 7TV emote set update: {e}")
@@ -0,0 +1,70 @@
+from hasherino.hasherino_dataclasses import Badge, Emote, EmoteSource
+
+__all__ = ["emote_url", "badge_url", "emote_height", "emote_width", "badge_height"]
+
+# (rendition height in pixels, CDN size name), smallest first
+_TWITCH_EMOTE_SIZES = ((28, "1.0"), (56, "2.0"), (112, "3.0"))
+_SEVENTV_EMOTE_SIZES = ((32, "1x"), (64, "2x"), (96, "3x"), (128, "4x"))
+_BADGE_SIZES = ((18, 0), (36, 1), (72, 2))
+
+
+def emote_height(font_size: float) -> float:
+    return font_size * 2
+
+
+def emote_width(emote: Emote, font_size: float) -> float:
+    """
+    Width the emote takes when displayed at emote_height(font_size), keeping its aspect
+    ratio. Emotes without known dimensions are assumed square, like twitch emotes.
+    """
+    if emote.width and emote.height:
+        return emote_height(font_size) * emote.width / emote.height
+
+    return emote_height(font_size)
+
+
+def badge_height(font_size: float) -> float:
+    return font_size
+
+
+def _smallest_covering(sizes: tuple, height: float):
+    """
+    Returns the name of the smallest rendition that is at least height pixels tall,
+    or the biggest one if none is.
+    """
+    for rendition_height, name in sizes:
+        if rendition_height >= height:
+            return name
+
+    return sizes[-1][1]
+
+
+def emote_url(
+    emote: Emote, height: float, pixel_ratio: float = 1.0, static: bool = False
+) -> str:
+    """
+    URL of the smallest rendition of the emote covering height logical pixels.
+
+    When static is True, animated emotes point to their first frame.
+    """
+    match emote.source:
+        case EmoteSource.SEVENTV:
+            size = _smallest_covering(_SEVENTV_EMOTE_SIZES, height * pixel_ratio)
+            suffix = "_static" if static and emote.animated else ""
+            return f"https://cdn.7tv.app/emote/{emote.id}/{size}{suffix}.webp"
+        case _:
+            # Twitch, the default source
+            size = _smallest_covering(_TWITCH_EMOTE_SIZES, height * pixel_ratio)
+            emote_format = "static" if static else "default"
+            return f"https://static-cdn.jtvnw.net/emoticons/v2/{emote.id}/{emote_format}/dark/{size}"
+
+
+def badge_url(badge: Badge, height: float, pixel_ratio: float = 1.0) -> str:
+    """
+    URL of the smallest rendition of the badge covering height logical pixels.
+    """
+    if not badge.urls:
+        return badge.url
+
+    index = _smallest_covering(_BADGE_SIZES, height * pixel_ratio)
+    return badge.urls[min(index, len(badge.urls) - 1)]
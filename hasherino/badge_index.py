@@ -0,0 +1,93 @@
+import logging
+import time
+
+from hasherino.api import helix
+from hasherino.hasherino_dataclasses import Badge
+
+__all__ = ["BadgeIndex"]
+
+# Set id -> version id -> badge
+Badges = dict[str, dict[str, Badge]]
+
+
+class BadgeIndex:
+    """
+    Twitch badges of every room, the global badge sets merged with the room's own.
+
+    Lookups are plain dict accesses, so resolving a message's badges costs the same as
+    before channel badges were loaded. A room's badges are refetched when it's loaded
+    again after ttl seconds.
+    """
+
+    def __init__(self, ttl: float = 60 * 60) -> None:
+        self.ttl = ttl
+
+        self._global: Badges = {}
+        self._channels: dict[str, Badges] = {}
+        self._loaded_at: dict[str, float] = {}
+        self._rooms: dict[str, Badges] = {}
+        # Channel login -> room id, USERSTATE messages don't carry the room id
+        self._room_ids: dict[str, str] = {}
+
+    @staticmethod
+    def _index(badge_sets: list[dict]) -> Badges:
+        return {
+            badge_set["set_id"]: {
+                version["id"]: Badge(
+                    badge_set["set_id"],
+                    version["title"],
+                    version["image_url_4x"],
+                    (
+                        version["image_url_1x"],
+                        version["image_url_2x"],
+                        version["image_url_4x"],
+                    ),
+                )
+                for version in badge_set["versions"]
+            }
+            for badge_set in badge_sets
+        }
+
+    def _merge(self, room_id: str):
+        # Channel sets replace global sets of the same id, like subscriber
+        self._rooms[room_id] = self._global | self._channels[room_id]
+
+    async def load_global(self, app_id: str, oauth_token: str):
+        self._global = self._index(await helix.get_global_badges(app_id, oauth_token))
+
+        for room_id in self._channels:
+            self._merge(room_id)
+
+        logging.debug(f"Indexed {len(self._global)} global badge sets")
+
+    async def load_room(
+        self, app_id: str, oauth_token: str, room_id: str, channel: str | None = None
+    ):
+        """
+        Fetches the channel badges of the room, unless they were fetched less than ttl
+        seconds ago.
+        """
+        if channel:
+            self._room_ids[channel.lower()] = room_id
+
+        if time.time() - self._loaded_at.get(room_id, 0) < self.ttl:
+            return
+
+        self._channels[room_id] = self._index(
+            await helix.get_channel_badges(app_id, oauth_token, room_id)
+        )
+        self._loaded_at[room_id] = time.time()
+        self._merge(room_id)
+
+        logging.debug(
+            f"Indexed {len(self._channels[room_id])} channel badge sets for {room_id}"
+        )
+
+    def for_room(self, room_id: str | None) -> Badges:
+        """
+        Badges of the room, only the global ones if its channel badges aren't loaded.
+        """
+        return self._rooms.get(room_id, self._global)
+
+    def for_channel(self, channel: str | None) -> Badges:
+        return self.for_room(self._room_ids.get((channel or "").lower()))
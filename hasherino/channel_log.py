@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+from hasherino.hasherino_dataclasses import (
+    Badge,
+    Emote,
+    EmoteSource,
+    HasherinoUser,
+    Message,
+)
+
+__all__ = ["ChannelLog", "message_to_record", "message_from_record"]
+
+
+def message_to_record(message: Message) -> dict:
+    return {
+        "user": {
+            "name": message.user.name,
+            "chat_color": message.user.chat_color,
+            "badges": [
+                {
+                    "id": badge.id,
+                    "name": badge.name,
+                    "url": badge.url,
+                    "urls": list(badge.urls),
+                }
+                for badge in message.user.badges or []
+            ],
+        },
+        "elements": [
+            element
+            if isinstance(element, str)
+            else {
+                "name": element.name,
+                "id": element.id,
+                "source": element.source.value,
+                "width": element.width,
+                "height": element.height,
+                "animated": element.animated,
+            }
+            for element in message.elements
+        ],
+        "message_type": message.message_type,
+        "me": message.me,
+        "timestamp": message.timestamp.timestamp() if message.timestamp else None,
+    }
+
+
+def message_from_record(record: dict) -> Message:
+    user = record["user"]
+
+    return Message(
+        user=HasherinoUser(
+            name=user["name"],
+            chat_color=user["chat_color"],
+            badges=[
+                Badge(badge["id"], badge["name"], badge["url"], tuple(badge["urls"]))
+                for badge in user["badges"]
+            ],
+        ),
+        elements=[
+            element
+            if isinstance(element, str)
+            else Emote(
+                name=element["name"],
+                id=element["id"],
+                source=EmoteSource(element["source"]),
+                width=element["width"],
+                height=element["height"],
+                animated=element["animated"],
+            )
+            for element in record["elements"]
+        ],
+        message_type=record["message_type"],
+        me=record["me"],
+        timestamp=datetime.fromtimestamp(record["timestamp"])
+        if record["timestamp"] is not None
+        else None,
+    )
+
+
+class _ChannelFile:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # Byte offset of every record written to the file
+        self.offsets: list[int] = []
+        self.size = 0
+        self.pending: list[str] = []
+        # Timestamp of the newest message logged, replayed history up to it is skipped
+        self.logged_until: float | None = None
+
+
+class ChannelLog:
+    """
+    Append-only per-channel message log, one JSON record per line.
+
+    Records are addressed by their index in the channel's log, so the chat can page
+    backwards from the oldest line it holds without keeping old lines in memory.
+    Appends are buffered and written by a background flush every flush_interval seconds.
+    """
+
+    def __init__(self, directory: Path, flush_interval: float = 2.0) -> None:
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._channels: dict[str, _ChannelFile] = {}
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+
+    async def _get_channel(self, channel: str) -> _ChannelFile:
+        channel = channel.lower()
+
+        async with self._lock:
+            if channel not in self._channels:
+                self._channels[channel] = await self._open(channel)
+
+        return self._channels[channel]
+
+    async def _open(self, channel: str) -> _ChannelFile:
+        channel_file = _ChannelFile(self.directory / f"{channel}.jsonl")
+
+        def scan():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            offset = 0
+            last_line = None
+
+            try:
+                with open(channel_file.path, "rb") as file:
+                    for line in file:
+                        channel_file.offsets.append(offset)
+                        offset += len(line)
+                        last_line = line
+            except FileNotFoundError:
+                pass
+
+            channel_file.size = offset
+
+            if last_line:
+                try:
+                    channel_file.logged_until = json.loads(last_line)["timestamp"]
+                except (json.JSONDecodeError, KeyError):
+                    pass
+
+        await asyncio.to_thread(scan)
+
+        logging.debug(f"Opened {channel} log with {len(channel_file.offsets)} messages")
+        return channel_file
+
+    async def append(self, channel: str, message: Message) -> int | None:
+        """
+        Logs the message and returns its index, or None if it's chat history that was
+        already logged, in this run or a previous one. Live messages are always logged.
+        """
+        channel_file = await self._get_channel(channel)
+        record = message_to_record(message)
+
+        if (
+            message.historical
+            and record["timestamp"] is not None
+            and channel_file.logged_until is not None
+            and record["timestamp"] <= channel_file.logged_until
+        ):
+            return None
+
+        channel_file.pending.append(json.dumps(record) + "\n")
+
+        if record["timestamp"] is not None:
+            channel_file.logged_until = max(
+                channel_file.logged_until or record["timestamp"], record["timestamp"]
+            )
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+        return len(channel_file.offsets) + len(channel_file.pending) - 1
+
+    async def count(self, channel: str) -> int:
+        channel_file = await self._get_channel(channel)
+        return len(channel_file.offsets) + len(channel_file.pending)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            for channel_file in self._channels.values():
+                if not channel_file.pending:
+                    continue
+
+                lines, channel_file.pending = channel_file.pending, []
+                encoded = [line.encode() for line in lines]
+
+                # Offsets are taken before writing so indexes handed out by append stay valid
+                for line in encoded:
+                    channel_file.offsets.append(channel_file.size)
+                    channel_file.size += len(line)
+
+                def write():
+                    with open(channel_file.path, "ab") as file:
+                        file.writelines(encoded)
+                        file.flush()
+                        os.fsync(file.fileno())
+
+                await asyncio.to_thread(write)
+
+    async def read_page(self, channel: str, before: int, count: int) -> list[Message]:
+        """
+        Returns up to count messages logged right before the message at index before,
+        oldest first.
+        """
+        await self.flush()
+        channel_file = await self._get_channel(channel)
+
+        before = min(before, len(channel_file.offsets))
+        start = max(before - count, 0)
+
+        if start >= before:
+            return []
+
+        start_offset = channel_file.offsets[start]
+        end_offset = (
+            channel_file.offsets[before]
+            if before < len(channel_file.offsets)
+            else channel_file.size
+        )
+
+        def read() -> bytes:
+            with open(channel_file.path, "rb") as file:
+                file.seek(start_offset)
+                return file.read(end_offset - start_offset)
+
+        data = await asyncio.to_thread(read)
+
+        return [
+            message_from_record(json.loads(line))
+            for line in data.decode().splitlines()
+            if line
+        ]
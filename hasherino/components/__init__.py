@@ -1,5 +1,5 @@
 from hasherino.components.account_dialog import AccountDialog
-from hasherino.components.chat_container import ChatContainer
+from hasherino.components.chat_container import ChatContainer, LowPowerMode
 from hasherino.components.chat_message import ChatMessage
 from hasherino.components.new_message_row import NewMessageRow
 from hasherino.components.settings_view import SettingsView
@@ -1,17 +1,17 @@
 import flet as ft
 
-from hasherino.storage import AsyncKeyValueStorage
+from hasherino.settings import Settings
 
 
 class AccountDialog(ft.AlertDialog):
-    def __init__(self, storage: AsyncKeyValueStorage):
+    def __init__(self, settings: Settings):
         # A dialog asking for a user display name
         self.join_user_name = ft.TextField(
             label="Enter your name to join the chat",
             autofocus=True,
             on_submit=self.join_chat_click,
         )
-        self.storage = storage
+        self.settings = settings
         super().__init__(
             open=True,
             modal=True,
@@ -28,6 +28,6 @@ class AccountDialog(ft.AlertDialog):
             self.join_user_name.error_text = "Name cannot be blank!"
             await self.join_user_name.update_async()
         else:
-            await self.storage.set("user_name", self.join_user_name.value)
+            await self.settings.update("user_name", self.join_user_name.value)
             self.page.dialog.open = False
             await self.page.update_async()
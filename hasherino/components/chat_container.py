@@ -1,33 +1,48 @@
 import asyncio
 import logging
+import time
+from collections import OrderedDict
 from enum import Enum, auto
 from math import isclose
 
 import flet as ft
 
-from hasherino.components.chat_message import ChatMessage
-from hasherino.hasherino_dataclasses import Message
-from hasherino.pubsub import PubSub
+from hasherino.components.chat_message import (
+    ChatMessage,
+    ChatNotice,
+    FontSizeSubscriber,
+    ShowTimestampSubscriber,
+)
+from hasherino.flood_governor import FloodGovernor, FloodLevel
+from hasherino.hasherino_dataclasses import Emote, Message
+from hasherino.settings import LowPowerMode, Settings
 from hasherino.storage import AsyncKeyValueStorage
 
 
-class ChatContainer(ft.Container):
+class ChatContainer(ft.Container, FontSizeSubscriber, ShowTimestampSubscriber):
     class _UiUpdateType(Enum):
         NO_UPDATE = (auto(),)
         SCROLL = (auto(),)
         PAGE = (auto(),)
 
+    # In low power mode, only emotes in this many of the newest lines are animated
+    ANIMATED_LINES = 10
+    # Average seconds a UI update may take before automatic low power mode kicks in
+    FRAME_COST_BUDGET = 0.1
+    # Seconds during which a repeated message is collapsed into the first line
+    DUPLICATE_WINDOW = 15.0
+    # Minimum seconds between handled scroll events, except for the one ending a scroll
+    SCROLL_EVENT_INTERVAL = 0.1
+    # Messages loaded from the channel log when scrolling past the oldest line
+    LOG_PAGE_SIZE = 50
+
     def __init__(
         self,
-        persistent_storage: AsyncKeyValueStorage,
+        settings: Settings,
         memory_storage: AsyncKeyValueStorage,
-        font_size_pubsub: PubSub,
-        ts_pubsub: PubSub,
     ):
-        self.persistent_storage = persistent_storage
+        self.settings = settings
         self.memory_storage = memory_storage
-        self.font_size_pubsub = font_size_pubsub
-        self.ts_pubsub = ts_pubsub
         self.is_chat_scrolled_down = False
         self.chat = ft.ListView(
             expand=True,
@@ -49,13 +64,36 @@ class ChatContainer(ft.Container):
             expand=True,
         )
         self.scheduled_ui_update: self._UiUpdateType = self._UiUpdateType.NO_UPDATE
+        self.low_power_mode = LowPowerMode.OFF
+        self._auto_low_power = False
+        self._frame_cost = 0.0
+        self.flood_governor = FloodGovernor()
+        self._skipped_since_marker = 0
+        # Normalized text hash -> (line, time it was first shown), oldest first
+        self._recent_lines: OrderedDict[int, tuple[ChatMessage, float]] = OrderedDict()
+        # While scrolled up, new messages wait here instead of being rendered
+        self.is_paused = False
+        self._paused_messages: list[tuple[Message, int | None]] = []
+        self._paused_count = 0
+        self._last_scroll_event = 0.0
+        # Newest lines were dropped to make room for older ones loaded from the channel log
+        self._detached = False
         asyncio.ensure_future(self.update_ui())
 
     async def scroll_to_bottom(self, _):
+        await self.resume()
         await self.chat.scroll_to_async(offset=-1, duration=10)
 
+    @property
+    def is_low_power(self) -> bool:
+        return self.low_power_mode == LowPowerMode.ON or (
+            self.low_power_mode == LowPowerMode.AUTOMATIC and self._auto_low_power
+        )
+
     async def update_ui(self):
         while True:
+            start = time.perf_counter()
+
             match self.scheduled_ui_update:
                 case self._UiUpdateType.SCROLL:
                     await self.chat.scroll_to_async(offset=-1, duration=10)
@@ -64,21 +102,198 @@ class ChatContainer(ft.Container):
                 case self._UiUpdateType.NO_UPDATE | _:
                     pass
 
+            cost = time.perf_counter() - start
+            if self.scheduled_ui_update != self._UiUpdateType.NO_UPDATE:
+                await self._measure_frame_cost(cost)
+            self.flood_governor.on_frame(cost)
+
             self.scheduled_ui_update = self._UiUpdateType.NO_UPDATE
 
-            await asyncio.sleep(
-                float(await self.persistent_storage.get("chat_update_rate"))
-            )
+            await asyncio.sleep(self.settings.chat_update_rate)
 
     async def on_scroll(self, event: ft.OnScrollEvent):
+        now = time.monotonic()
+        if (
+            event.event_type != "end"
+            and now - self._last_scroll_event < self.SCROLL_EVENT_INTERVAL
+        ):
+            return
+        self._last_scroll_event = now
+
+        was_scrolled_down = self.is_chat_scrolled_down
         self.is_chat_scrolled_down = isclose(
             event.pixels, event.max_scroll_extent, rel_tol=0.01
         )
-        self.scroll_down_btn.visible = not self.is_chat_scrolled_down
-        await self.scroll_down_btn.update_async()
+
+        if event.event_type == "end":
+            if self.is_chat_scrolled_down:
+                await self.resume()
+            else:
+                self.is_paused = True
+
+                if event.pixels <= event.min_scroll_extent + 1:
+                    await self.load_older()
+
+        if was_scrolled_down != self.is_chat_scrolled_down:
+            self.scroll_down_btn.visible = not self.is_chat_scrolled_down
+            await self.scroll_down_btn.update_async()
+
+    async def resume(self):
+        """
+        Renders messages received while paused in one go, trimming the chat once.
+        """
+        if not self.is_paused:
+            return
+
+        self.is_paused = False
+        messages, self._paused_messages = self._paused_messages, []
+        logging.debug(
+            f"Resuming chat with {len(messages)} of {self._paused_count} new messages"
+        )
+
+        if self._detached:
+            # The newest lines were dropped while paging back, reload them from the log
+            messages = await self._load_latest_from_log() or messages
+            self.chat.controls.clear()
+            self._detached = False
+        elif self._paused_count > len(messages):
+            self._skipped_since_marker += self._paused_count - len(messages)
+
+        self._paused_count = 0
+        self.scroll_down_btn.text = None
+
+        for message, log_index in messages:
+            # Already shown to the user as a count, don't let the burst trip the flood governor
+            await self._add_line(message, log_index, sample=False)
+
+        await self._trim()
+        self.scheduled_ui_update = self._UiUpdateType.SCROLL
+
+    async def _load_latest_from_log(self) -> list[tuple[Message, int]]:
+        channel_log = await self.memory_storage.get("channel_log")
+        channel = self.settings.channel
+
+        if not channel_log or not channel:
+            return []
+
+        end = await channel_log.count(channel)
+        page = await channel_log.read_page(
+            channel, end, self.settings.max_messages_per_chat
+        )
+        first_index = end - len(page)
+        return [(message, first_index + i) for i, message in enumerate(page)]
+
+    async def load_older(self):
+        """
+        Prepends a page of older messages from the channel log, dropping the newest lines
+        so the number of lines held stays under max_messages_per_chat.
+        """
+        channel_log = await self.memory_storage.get("channel_log")
+        channel = self.settings.channel
+        oldest = next(
+            (
+                control
+                for control in self.chat.controls
+                if isinstance(control, ChatMessage) and control.log_index is not None
+            ),
+            None,
+        )
+
+        if not channel_log or not channel or not oldest or oldest.log_index == 0:
+            return
+
+        # Room is left for the line the user is looking at, it must not be trimmed
+        page = await channel_log.read_page(
+            channel,
+            oldest.log_index,
+            min(self.LOG_PAGE_SIZE, self.settings.max_messages_per_chat - 1),
+        )
+        first_index = oldest.log_index - len(page)
+        lines = []
+
+        for i, message in enumerate(page):
+            line = await self._make_chat_message(
+                message, animate_emotes=not self.is_low_power
+            )
+            line.log_index = first_index + i
+            lines.append(line)
+
+        position = self.chat.controls.index(oldest)
+        self.chat.controls[position:position] = lines
+
+        # Only lines after oldest are dropped
+        excess = min(
+            len(self.chat.controls) - self.settings.max_messages_per_chat,
+            len(self.chat.controls) - self.chat.controls.index(oldest) - 1,
+        )
+        if excess > 0:
+            del self.chat.controls[-excess:]
+            self._detached = True
+
+        logging.debug(f"Loaded {len(lines)} older messages of {channel} from the log")
+
+        # Keep the line the user was looking at in place
+        oldest.key = f"log-{oldest.log_index}"
+        await self.page.update_async()
+        await self.chat.scroll_to_async(key=oldest.key, duration=0)
+
+    async def _measure_frame_cost(self, cost: float):
+        # Exponential moving average, a single slow update shouldn't switch modes
+        self._frame_cost = 0.8 * self._frame_cost + 0.2 * cost
+
+        if (
+            self.low_power_mode == LowPowerMode.AUTOMATIC
+            and not self._auto_low_power
+            and self._frame_cost > self.FRAME_COST_BUDGET
+        ):
+            logging.info(
+                f"Average UI update took {self._frame_cost:.3f}s, enabling low power mode"
+            )
+            self._auto_low_power = True
+            await self._apply_low_power()
+        elif (
+            self.low_power_mode == LowPowerMode.AUTOMATIC
+            and self._auto_low_power
+            and self._frame_cost < self.FRAME_COST_BUDGET / 2
+        ):
+            # Well under budget, so it doesn't flip back and forth around it
+            logging.info(
+                f"Average UI update took {self._frame_cost:.3f}s, disabling low power mode"
+            )
+            self._auto_low_power = False
+            await self._apply_low_power()
+
+    async def on_low_power_mode_changed(self, mode: LowPowerMode):
+        self.low_power_mode = LowPowerMode(mode)
+        await self._apply_low_power()
+
+    async def _apply_low_power(self):
+        """
+        Animates emotes of every line, or only the newest ones when in low power mode.
+        """
+        low_power = self.is_low_power
+        first_animated = len(self.chat.controls) - self.ANIMATED_LINES
+
+        for i, control in enumerate(self.chat.controls):
+            if isinstance(control, ChatMessage):
+                await control.set_animate_emotes(not low_power or i >= first_animated)
+
+        if self.scheduled_ui_update != self._UiUpdateType.SCROLL:
+            self.scheduled_ui_update = self._UiUpdateType.PAGE
+
+    async def on_font_size_changed(self, new_font_size: int):
+        # Only lines still in the chat get restyled, trimmed ones are left to the GC
+        for control in self.chat.controls:
+            if isinstance(control, FontSizeSubscriber):
+                await control.on_font_size_changed(new_font_size)
+
+    async def on_show_timestamp_changed(self, show_timestamp: bool):
+        for control in self.chat.controls:
+            if isinstance(control, ShowTimestampSubscriber):
+                await control.on_show_timestamp_changed(show_timestamp)
 
     async def add_author_to_user_set(self, author: str):
-        tab_name = await self.persistent_storage.get("channel")
+        tab_name = self.settings.channel
 
         # Get existing list from memory or initialize a new one
         if user_set := await self.memory_storage.get("channel_user_list"):
@@ -93,33 +308,159 @@ class ChatContainer(ft.Container):
 
         await self.memory_storage.set("channel_user_list", user_set)
 
+    @staticmethod
+    def _text_hash(message: Message) -> int:
+        text = " ".join(
+            element.name if isinstance(element, Emote) else element
+            for element in message.elements
+        )
+        return hash(" ".join(text.casefold().split()))
+
+    async def _collapse_duplicate(self, message: Message) -> bool:
+        """
+        Adds to the repeat counter of a recent line with the same text instead of showing
+        a new line. Returns whether the message was collapsed.
+        """
+        now = time.monotonic()
+
+        while self._recent_lines:
+            _, (_, shown_at) = next(iter(self._recent_lines.items()))
+            if now - shown_at <= self.DUPLICATE_WINDOW:
+                break
+            self._recent_lines.popitem(last=False)
+
+        text_hash = self._text_hash(message)
+
+        if text_hash in self._recent_lines:
+            line, _ = self._recent_lines[text_hash]
+
+            if line in self.chat.controls:
+                await line.add_repeat()
+                return True
+
+        return False
+
+    async def _remember_line(self, message: Message, line: ChatMessage):
+        self._recent_lines[self._text_hash(message)] = (line, time.monotonic())
+
     async def on_message(self, message: Message):
+        log_index = None
+        if message.message_type == "chat_message":
+            channel_log = await self.memory_storage.get("channel_log")
+            channel = self.settings.channel
+
+            if channel_log and channel:
+                log_index = await channel_log.append(channel, message)
+
+        if self.is_paused:
+            self._paused_messages.append((message, log_index))
+            self._paused_count += 1
+
+            # Older messages would be trimmed on resume anyway
+            max_messages = self.settings.max_messages_per_chat
+            if len(self._paused_messages) > max_messages:
+                del self._paused_messages[:-max_messages]
+
+            self.scroll_down_btn.text = f"{self._paused_count} new messages"
+            if self.scheduled_ui_update == self._UiUpdateType.NO_UPDATE:
+                self.scheduled_ui_update = self._UiUpdateType.PAGE
+            return
+
+        if await self._add_line(message, log_index):
+            await self._trim()
+            self._schedule_update()
+
+    async def _make_chat_message(
+        self, message: Message, condensed: bool = False, animate_emotes: bool = True
+    ) -> ChatMessage:
+        return ChatMessage(
+            message,
+            self.page,
+            self.settings.chat_font_size,
+            self.settings.show_timestamp,
+            await self.memory_storage.get("image_cache"),
+            self.settings.device_pixel_ratio,
+            animate_emotes=animate_emotes,
+            condensed=condensed,
+        )
+
+    async def _add_line(
+        self, message: Message, log_index: int | None = None, sample: bool = True
+    ) -> bool:
+        """
+        Adds the message to the end of the chat, returns whether the chat changed.
+        """
+        collapse = (
+            message.message_type == "chat_message" and self.settings.collapse_duplicates
+        )
+
+        if collapse and await self._collapse_duplicate(message):
+            return True
+
+        if (
+            message.message_type == "chat_message"
+            and sample
+            and not self.flood_governor.should_render()
+        ):
+            self._skipped_since_marker += 1
+            logging.debug(
+                f"Flooded, skipped rendering message from {message.user.name}: {message.elements}"
+            )
+            return False
+
+        if self._skipped_since_marker:
+            self.chat.controls.append(
+                ChatNotice(
+                    f"{self._skipped_since_marker} messages skipped",
+                    self.settings.chat_font_size,
+                )
+            )
+            self._skipped_since_marker = 0
+
         if message.message_type == "chat_message":
-            m = ChatMessage(
-                message, self.page, await self.persistent_storage.get("chat_font_size")
+            m = await self._make_chat_message(
+                message, self.flood_governor.level >= FloodLevel.CONDENSED
             )
+            m.log_index = log_index
             await self.add_author_to_user_set(message.user.name)
-            await m.subscribe_to_font_size_change(self.font_size_pubsub)
-            await m.subscribe_to_show_timestamp_change(self.ts_pubsub)
+
+            if collapse:
+                await self._remember_line(message, m)
+
+            if prefetcher := await self.memory_storage.get("emote_prefetcher"):
+                prefetcher.record_usage(
+                    self.settings.channel,
+                    (e for e in message.elements if isinstance(e, Emote)),
+                )
 
         elif message.message_type == "login_message":
             m = ft.Text(
                 message.elements[0],
                 italic=True,
-                size=await self.persistent_storage.get("chat_font_size"),
+                size=self.settings.chat_font_size,
             )
 
         self.chat.controls.append(m)
 
-        n_messages_to_remove = len(
-            self.chat.controls
-        ) - await self.persistent_storage.get("max_messages_per_chat")
+        # Stop animating the line that just left the newest ANIMATED_LINES
+        if self.is_low_power and len(self.chat.controls) > self.ANIMATED_LINES:
+            line = self.chat.controls[-self.ANIMATED_LINES - 1]
+            if isinstance(line, ChatMessage):
+                await line.set_animate_emotes(False)
+
+        return True
+
+    async def _trim(self):
+        n_messages_to_remove = (
+            len(self.chat.controls) - self.settings.max_messages_per_chat
+        )
         if n_messages_to_remove > 0:
             del self.chat.controls[:n_messages_to_remove]
             logging.debug(
                 f"Chat has {len(self.chat.controls)} lines in it, removed {n_messages_to_remove}"
             )
 
+    def _schedule_update(self):
         if self.is_chat_scrolled_down:
             self.scheduled_ui_update = self._UiUpdateType.SCROLL
         elif (
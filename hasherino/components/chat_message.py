@@ -3,8 +3,15 @@ from abc import ABC, abstractmethod
 import flet as ft
 import validators
 
-from hasherino.hasherino_dataclasses import Emote, Message
-from hasherino.pubsub import PubSub
+from hasherino.asset_urls import (
+    badge_height,
+    badge_url,
+    emote_height,
+    emote_url,
+    emote_width,
+)
+from hasherino.hasherino_dataclasses import Badge, Emote, Message
+from hasherino.image_cache import ImageCache
 
 
 class FontSizeSubscriber(ABC):
@@ -36,30 +43,94 @@ class ChatText(ft.Container, FontSizeSubscriber):
         self.content.size = new_font_size
 
 
+def _resolve_src(image_cache: ImageCache | None, url: str) -> str:
+    return image_cache.resolve(url) if image_cache else url
+
+
 class ChatBadge(ft.Image, FontSizeSubscriber):
-    def __init__(self, src: str, height: int):
-        super().__init__(src=src, height=height)
+    def __init__(
+        self,
+        badge: Badge,
+        font_size: int,
+        image_cache: ImageCache | None = None,
+        pixel_ratio: float = 1.0,
+    ):
+        self.badge = badge
+        self.image_cache = image_cache
+        self.pixel_ratio = pixel_ratio
+        super().__init__(src=self._get_src(font_size), height=badge_height(font_size))
+
+    def _get_src(self, font_size: int) -> str:
+        url = badge_url(self.badge, badge_height(font_size), self.pixel_ratio)
+        return _resolve_src(self.image_cache, url)
 
     async def on_font_size_changed(self, new_font_size: int):
-        self.height = new_font_size
+        self.height = badge_height(new_font_size)
+        self.src = self._get_src(new_font_size)
 
 
 class ChatEmote(ft.Container, FontSizeSubscriber):
-    def __init__(self, *args, **kwargs):
-        self.emote: Emote | None = kwargs.pop("emote", None)
-        super().__init__(
-            content=ft.Image(
-                tooltip=self.emote.name if self.emote else "", *args, **kwargs
-            ),
+    def __init__(
+        self,
+        emote: Emote,
+        font_size: int,
+        image_cache: ImageCache | None = None,
+        pixel_ratio: float = 1.0,
+        animate: bool = True,
+    ):
+        self.emote = emote
+        self.image_cache = image_cache
+        self.pixel_ratio = pixel_ratio
+        self.font_size = font_size
+        self.animate = animate
+        # Both dimensions are known up front so the line doesn't relayout once the image loads
+        self.image = ft.Image(
+            tooltip=emote.name,
+            src=self._get_src(),
+            height=emote_height(font_size),
+            width=emote_width(emote, font_size),
+        )
+        super().__init__(content=self.image)
+        # Static animated emotes animate while hovered
+        self.on_hover = self._on_hover if emote.animated and not animate else None
+
+    def _get_src(self, animate: bool | None = None) -> str:
+        # Smallest CDN rendition covering the displayed size, recomputed on font changes
+        url = emote_url(
+            self.emote,
+            emote_height(self.font_size),
+            self.pixel_ratio,
+            static=self.emote.animated
+            and not (self.animate if animate is None else animate),
         )
+        return _resolve_src(self.image_cache, url)
+
+    async def _on_hover(self, e: ft.HoverEvent):
+        self.image.src = self._get_src(animate=e.data == "true")
+        await self.image.update_async()
+
+    async def set_animate(self, animate: bool):
+        """
+        Switches between the animated image and its static first frame.
+        """
+        # Only animated emotes have a static rendition, others keep their cached url
+        if animate != self.animate and self.emote.animated:
+            self.animate = animate
+            self.image.src = self._get_src()
+            self.on_hover = None if animate else self._on_hover
 
     async def on_font_size_changed(self, new_font_size: int):
-        self.height = new_font_size * 2
+        self.font_size = new_font_size
+        self.image.height = emote_height(new_font_size)
+        self.image.width = emote_width(self.emote, new_font_size)
+        self.image.src = self._get_src()
 
 
 class ChatTimestamp(ft.Text, ShowTimestampSubscriber, FontSizeSubscriber):
-    def __init__(self, text: str, color: str, size: int):
-        super().__init__(text, size=size, color=color, selectable=False)
+    def __init__(self, text: str, color: str, size: int, visible: bool = True):
+        super().__init__(
+            text, size=size, color=color, selectable=False, visible=visible
+        )
 
     async def on_show_timestamp_changed(self, show_timestamp: bool):
         self.visible = bool(show_timestamp)
@@ -68,14 +139,53 @@ class ChatTimestamp(ft.Text, ShowTimestampSubscriber, FontSizeSubscriber):
         self.size = max(new_font_size - 4, 4)
 
 
-class ChatMessage(ft.Row):
-    def __init__(self, message: Message, page: ft.Page, font_size: int):
+class ChatNotice(ft.Text, FontSizeSubscriber):
+    """
+    Italic grey line about the chat itself rather than a message, like skipped messages.
+    """
+
+    def __init__(self, text: str, size: int):
+        super().__init__(text, italic=True, color=ft.colors.GREY, size=size)
+
+    async def on_font_size_changed(self, new_font_size: int):
+        self.size = new_font_size
+
+
+class ChatMessage(ft.Row, FontSizeSubscriber, ShowTimestampSubscriber):
+    """
+    Single chat line.
+
+    Style changes are pushed by the owning ChatContainer to the lines it currently holds,
+    so trimmed lines aren't kept alive by any subscription.
+    """
+
+    def __init__(
+        self,
+        message: Message,
+        page: ft.Page,
+        font_size: int,
+        show_timestamp: bool = True,
+        image_cache: ImageCache | None = None,
+        pixel_ratio: float = 1.0,
+        animate_emotes: bool = True,
+        condensed: bool = False,
+    ):
         super().__init__()
         self.vertical_alignment = "start"
         self.wrap = True
         self.width = page.width
         self.page = page
         self.font_size = font_size
+        self.show_timestamp = show_timestamp
+        self.image_cache = image_cache
+        self.pixel_ratio = pixel_ratio
+        self.animate_emotes = animate_emotes
+        # Text only line, used when the chat is flooded
+        self.condensed = condensed
+        self.repeat_count = 1
+        self.repeat_counter: ChatText | None = None
+        # Index of the message in the channel log, None when it wasn't logged
+        self.log_index: int | None = None
         self.spacing = 2
         self.run_spacing = 0
         self.vertical_alignment = ft.CrossAxisAlignment.CENTER
@@ -89,12 +199,17 @@ class ChatMessage(ft.Row):
                     text=f"{message.timestamp.strftime('%H:%M')} ",
                     color=ft.colors.GREY,
                     size=max(self.font_size - 4, 4),
+                    visible=bool(self.show_timestamp),
                 )
             )
 
-        self.controls.extend(
-            [ChatBadge(badge.url, self.font_size) for badge in message.user.badges]
-        )
+        if not self.condensed:
+            self.controls.extend(
+                [
+                    ChatBadge(badge, self.font_size, self.image_cache, self.pixel_ratio)
+                    for badge in message.user.badges
+                ]
+            )
 
         self.controls.append(
             ChatText(
@@ -109,29 +224,55 @@ class ChatMessage(ft.Row):
             if type(element) is str:
                 color = message.user.chat_color if message.me else ""
                 result = ChatText(element, color, self.font_size)
+            elif type(element) is Emote and self.condensed:
+                result = ChatText(element.name, "", self.font_size)
             elif type(element) is Emote:
                 result = ChatEmote(
-                    emote=element, src=element.url, height=self.font_size * 2
+                    element,
+                    self.font_size,
+                    self.image_cache,
+                    self.pixel_ratio,
+                    self.animate_emotes,
                 )
             else:
                 raise TypeError
 
             self.controls.append(result)
 
-    async def subscribe_to_font_size_change(self, pubsub: PubSub):
-        await pubsub.subscribe_all(
-            [
-                control.on_font_size_changed
-                for control in self.controls
-                if isinstance(control, FontSizeSubscriber)
-            ]
-        )
+    async def add_repeat(self):
+        """
+        Another copy of this line was received, shown as a ×N counter at the end of it.
+        """
+        self.repeat_count += 1
 
-    async def subscribe_to_show_timestamp_change(self, pubsub: PubSub):
-        await pubsub.subscribe_all(
-            [
-                control.on_show_timestamp_changed
-                for control in self.controls
-                if isinstance(control, ShowTimestampSubscriber)
-            ]
-        )
+        if self.repeat_counter is None:
+            self.repeat_counter = ChatText(
+                f"×{self.repeat_count}", ft.colors.GREY, self.font_size, weight="bold"
+            )
+            self.controls.append(self.repeat_counter)
+        else:
+            self.repeat_counter.content.value = f"×{self.repeat_count}"
+
+    async def set_animate_emotes(self, animate: bool):
+        if animate == self.animate_emotes:
+            return
+
+        self.animate_emotes = animate
+
+        for control in self.controls:
+            if isinstance(control, ChatEmote):
+                await control.set_animate(animate)
+
+    async def on_font_size_changed(self, new_font_size: int):
+        self.font_size = new_font_size
+
+        for control in self.controls:
+            if isinstance(control, FontSizeSubscriber):
+                await control.on_font_size_changed(new_font_size)
+
+    async def on_show_timestamp_changed(self, show_timestamp: bool):
+        self.show_timestamp = show_timestamp
+
+        for control in self.controls:
+            if isinstance(control, ShowTimestampSubscriber):
+                await control.on_show_timestamp_changed(show_timestamp)
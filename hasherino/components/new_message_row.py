@@ -10,6 +10,7 @@ from hasherino.api import helix
 from hasherino.api.helix import NormalUserColor
 from hasherino.factory import message_factory
 from hasherino.hasherino_dataclasses import Emote, HasherinoUser
+from hasherino.settings import Settings
 from hasherino.storage import AsyncKeyValueStorage
 
 
@@ -57,11 +58,13 @@ class NewMessageRow(ft.Row):
         self,
         memory_storage: AsyncKeyValueStorage,
         persistent_storage: AsyncKeyValueStorage,
+        settings: Settings,
         chat_container_on_message: Awaitable,
         reconnect_callback: Awaitable,
     ):
         self.memory_storage = memory_storage
         self.persistent_storage = persistent_storage
+        self.settings = settings
         self.chat_container_on_message = chat_container_on_message
         self.reconnect_callback = reconnect_callback
 
@@ -96,6 +99,9 @@ class NewMessageRow(ft.Row):
         await self.page.update_async()
 
     async def new_message_change(self, e):
+        if prefetcher := await self.memory_storage.get("emote_prefetcher"):
+            prefetcher.notify_activity()
+
         await self.new_message_clear_error(e)
         await self.clear_cycle_status()
 
@@ -104,12 +110,11 @@ class NewMessageRow(ft.Row):
             return
 
         stv_emotes = await self.memory_storage.get("7tv_emotes")
-        channel_stv_emotes = (
-            stv_emotes[await self.persistent_storage.get("channel")]
-            if stv_emotes
-            else {}
+        channel_stv_emotes = (stv_emotes or {}).get(self.settings.channel, {})
+        # Not there until the user's emote sets are loaded
+        emote_map: dict[str, Emote] = (
+            await self.memory_storage.get("ttv_emote_sets") or {}
         )
-        emote_map: dict[str, Emote] = await self.memory_storage.get("ttv_emote_sets")
         emote_names = list(emote_map.keys()) + list(channel_stv_emotes.keys())
 
         if emote_names:
@@ -165,9 +170,7 @@ class NewMessageRow(ft.Row):
                 f"Attempting username completion. last_space_index: {last_space_index} last_word: {last_word}"
             )
 
-            sorted_user_list = sorted(
-                user_list[await self.persistent_storage.get("channel")]
-            )
+            sorted_user_list = sorted(user_list[self.settings.channel])
 
             for user in sorted_user_list:
                 if user.lower().startswith(last_word.lower()):
@@ -189,12 +192,10 @@ class NewMessageRow(ft.Row):
             await self.cycle_status.down()
 
     async def new_message_focus(self, e):
-        if await self.persistent_storage.get("user_name"):
-            e.control.prefix = ft.Text(
-                f"{await self.persistent_storage.get('user_name')}: "
-            )
+        if self.settings.user_name:
+            e.control.prefix = ft.Text(f"{self.settings.user_name}: ")
 
-            channel = await self.persistent_storage.get("channel")
+            channel = self.settings.channel
             if channel:
                 e.control.hint_text = f"Write a message on channel {channel}"
             else:
@@ -210,21 +211,26 @@ class NewMessageRow(ft.Row):
 
         disconnect_error = "Please connect to twitch before sending messages."
 
-        websocket = await self.memory_storage.get("websocket")
+        session = await self.memory_storage.get_many(
+            ("websocket", "ttv_emote_sets", "7tv_emotes", "user_badges", "user_color")
+        )
+        channel = self.settings.channel
+
+        websocket = session["websocket"]
         is_connected = websocket and await websocket.is_connected()
         if not is_connected:
             self.new_message.error_text = disconnect_error
             await self.update_async()
             return
 
-        if not bool(await self.persistent_storage.get("user_name")):
+        if not bool(self.settings.user_name):
             self.new_message.error_text = (
                 "Please connect to twitch before sending messages."
             )
             await self.update_async()
             return
 
-        if not await self.persistent_storage.get("channel"):
+        if not channel:
             self.new_message.error_text = (
                 "Please connect to a channel before sending messages."
             )
@@ -233,35 +239,28 @@ class NewMessageRow(ft.Row):
 
         try:
             async with asyncio.timeout(2):
-                await websocket.send_message(
-                    await self.persistent_storage.get("channel"), self.new_message.value
-                )
+                await websocket.send_message(channel, self.new_message.value)
         except (asyncio.TimeoutError, Exception):
             await self.reconnect_callback(True)
             self.new_message.error_text = disconnect_error
             await self.update_async()
             return
 
-        emote_map: dict[str, Emote] = await self.memory_storage.get("ttv_emote_sets")
-
-        stv_emotes: dict[str, dict[str, Emote]] | None = await self.memory_storage.get(
-            "7tv_emotes"
-        )
-        channel = await self.persistent_storage.get("channel")
-        if stv_emotes and channel:
-            channel_stv_emotes = stv_emotes.get(
-                await self.persistent_storage.get("channel"), {}
-            )
+        stv_emotes: dict[str, dict[str, Emote]] | None = session["7tv_emotes"]
+        if stv_emotes:
+            channel_stv_emotes = stv_emotes.get(channel, {})
         else:
             channel_stv_emotes = {}
 
-        emote_map.update(channel_stv_emotes)
+        emote_map: dict[str, Emote] = (
+            session["ttv_emote_sets"] or {}
+        ) | channel_stv_emotes
 
         message = message_factory(
             HasherinoUser(
-                name=await self.persistent_storage.get("user_name"),
-                badges=await self.memory_storage.get("user_badges"),
-                chat_color=await self.memory_storage.get("user_color"),
+                name=self.settings.user_name,
+                badges=session["user_badges"],
+                chat_color=session["user_color"],
             ),
             self.new_message.value,
             emote_map,
@@ -275,7 +274,7 @@ class NewMessageRow(ft.Row):
         await self.new_message.focus_async()
         await self.page.update_async()
 
-        if await self.persistent_storage.get("color_switcher"):
+        if self.settings.color_switcher:
             # Using user_color can cause the color to repeat , since it gets replaced on USERSTATE messages
             color_index = await self.memory_storage.get("user_color_index")
 
@@ -298,9 +297,9 @@ class NewMessageRow(ft.Row):
 
             try:
                 await helix.update_chat_color(
-                    await self.persistent_storage.get("app_id"),
+                    self.settings.app_id,
                     await self.persistent_storage.get("token"),
-                    await self.persistent_storage.get("user_id"),
+                    self.settings.user_id,
                     next_color,
                 )
                 logging.info(f"Switcher set user color to {next_color}")
@@ -1,21 +1,16 @@
-import logging
 from pathlib import Path
 
 import flet as ft
 
-from hasherino.pubsub import PubSub
-from hasherino.storage import AsyncKeyValueStorage, get_default_os_settings_path
+from hasherino.settings import LowPowerMode, Settings
+from hasherino.storage import get_default_os_settings_path
 
 LOG_PATH = get_default_os_settings_path() / "hasherino.log"
 
 
 class SettingsView(ft.View):
-    def __init__(
-        self, font_size_pubsub: PubSub, ts_pubsub: PubSub, storage: AsyncKeyValueStorage
-    ):
-        self.font_size_pubsub = font_size_pubsub
-        self.ts_pubsub = ts_pubsub
-        self.storage = storage
+    def __init__(self, settings: Settings):
+        self.settings = settings
 
     async def init(self):
         super().__init__(
@@ -40,14 +35,14 @@ class SettingsView(ft.View):
                 controls=[
                     ft.Text(),
                     ft.TextField(
-                        value=await self.storage.get("max_messages_per_chat"),
+                        value=self.settings.max_messages_per_chat,
                         label="Max. messages per chat",
                         width=500,
                         on_change=self._max_messages_change,
                     ),
                     ft.Text(),
                     ft.TextField(
-                        value=await self.storage.get("chat_update_rate"),
+                        value=self.settings.chat_update_rate,
                         label="Chat UI Update rate(lower = higher CPU usage):",
                         width=500,
                         on_change=self._chat_update_rate_change,
@@ -69,18 +64,28 @@ class SettingsView(ft.View):
                             ),
                             ft.Checkbox(
                                 on_change=self._history_click,
-                                value=await self.storage.get("chat_history"),
+                                value=self.settings.chat_history,
                                 label_position=ft.LabelPosition.LEFT,
                             ),
                         ],
                         alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
                     ),
+                    ft.Row(
+                        controls=[
+                            ft.Text("Collapse repeated messages", size=16),
+                            ft.Checkbox(
+                                on_change=self._collapse_duplicates_click,
+                                value=self.settings.collapse_duplicates,
+                            ),
+                        ],
+                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                    ),
                     ft.Row(
                         controls=[
                             ft.Text("Show message timestamp", size=16),
                             ft.Checkbox(
                                 on_change=self._show_timestamp_click,
-                                value=await self.storage.get("show_timestamp"),
+                                value=self.settings.show_timestamp,
                             ),
                         ],
                         alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
@@ -103,7 +108,7 @@ class SettingsView(ft.View):
                                 size=16,
                             ),
                             ft.Slider(
-                                value=await self.storage.get("chat_font_size"),
+                                value=self.settings.chat_font_size,
                                 min=10,
                                 max=50,
                                 divisions=40,
@@ -119,7 +124,7 @@ class SettingsView(ft.View):
                         controls=[
                             ft.Text("Theme", size=16),
                             ft.Dropdown(
-                                value=await self.storage.get("theme"),
+                                value=self.settings.theme,
                                 options=[
                                     ft.dropdown.Option("System"),
                                     ft.dropdown.Option("Dark mode"),
@@ -132,11 +137,35 @@ class SettingsView(ft.View):
                         alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
                     ),
                     ft.Text(),
+                    ft.Row(
+                        controls=[
+                            ft.Row(
+                                [
+                                    ft.Text("Low power mode", size=16),
+                                    ft.Icon(
+                                        ft.icons.INFO,
+                                        tooltip="Only animate emotes in the newest lines or on hover. "
+                                        "Automatic turns it on when the chat takes too long to render.",
+                                    ),
+                                ]
+                            ),
+                            ft.Dropdown(
+                                value=self.settings.low_power_mode,
+                                options=[
+                                    ft.dropdown.Option(mode) for mode in LowPowerMode
+                                ],
+                                width=200,
+                                on_change=self._low_power_mode_select,
+                            ),
+                        ],
+                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                    ),
+                    ft.Text(),
                     ft.Row(
                         controls=[
                             ft.Text("Chat color cycling", size=16),
                             ft.Checkbox(
-                                value=await self.storage.get("color_switcher"),
+                                value=self.settings.color_switcher,
                                 label_position=ft.LabelPosition.LEFT,
                                 on_change=self._on_color_switcher_click,
                             ),
@@ -172,7 +201,7 @@ class SettingsView(ft.View):
         )
 
     async def _on_color_switcher_click(self, e):
-        await self.storage.set("color_switcher", e.control.value)
+        await self.settings.update("color_switcher", e.control.value)
 
     async def _theme_select(self, e):
         match e.data:
@@ -185,26 +214,22 @@ class SettingsView(ft.View):
             case _:
                 pass
 
-        await self.storage.set("theme", e.data)
+        await self.settings.update("theme", e.data)
         await self.page.update_async()
 
+    async def _low_power_mode_select(self, e):
+        await self.settings.update("low_power_mode", e.data)
+
     async def _show_timestamp_click(self, e):
-        await self.storage.set("show_timestamp", e.control.value)
-        await self.ts_pubsub.send(e.control.value)
+        await self.settings.update("show_timestamp", e.control.value)
 
     async def _log_path_copy_click(self, _):
         await self.page.set_clipboard_async(str(LOG_PATH.absolute()))
 
     async def _max_messages_change(self, e):
         try:
-            value = int(e.control.value)
-
-            if value < 10 or value > 500:
-                raise ValueError
-
-            await self.storage.set("max_messages_per_chat", value)
+            await self.settings.update("max_messages_per_chat", int(e.control.value))
             e.control.error_text = ""
-            logging.debug(f"Updated max_messages_per_chat to {value}")
 
         except ValueError:
             e.control.error_text = "Value must be an integer between 10 and 500!"
@@ -217,20 +242,13 @@ class SettingsView(ft.View):
         await self.page.update_async()
 
     async def _font_size_change(self, e):
-        await self.storage.set("chat_font_size", e.control.value)
-        await self.font_size_pubsub.send(e.control.value)
+        await self.settings.update("chat_font_size", e.control.value)
         await self.page.update_async()
 
     async def _chat_update_rate_change(self, e):
         try:
-            value = float(e.control.value)
-
-            if value < 0.3 or value > 1:
-                raise ValueError
-
+            await self.settings.update("chat_update_rate", e.control.value)
             e.control.error_text = ""
-            await self.storage.set("chat_update_rate", e.control.value)
-            logging.debug(f"Set chat_update_rate to {value}")
 
         except ValueError:
             e.control.error_text = "Value must be a decimal between 0.3 and 1."
@@ -238,5 +256,8 @@ class SettingsView(ft.View):
         finally:
             await self.page.update_async()
 
+    async def _collapse_duplicates_click(self, e):
+        await self.settings.update("collapse_duplicates", e.control.value)
+
     async def _history_click(self, e):
-        await self.storage.set("chat_history", e.control.value)
+        await self.settings.update("chat_history", e.control.value)
@@ -1,5 +1,7 @@
 import flet as ft
 
+from hasherino.pubsub import PubSub, Topic
+from hasherino.settings import Settings
 from hasherino.storage import AsyncKeyValueStorage
 
 
@@ -7,7 +9,8 @@ class StatusColumn(ft.Column):
     def __init__(
         self,
         memory_storage: AsyncKeyValueStorage,
-        persistent_storage: AsyncKeyValueStorage,
+        settings: Settings,
+        pubsub: PubSub,
     ):
         self.reconnecting_status = ft.Row(
             vertical_alignment=ft.CrossAxisAlignment.CENTER,
@@ -18,12 +21,14 @@ class StatusColumn(ft.Column):
         )
 
         self.memory_storage = memory_storage
-        self.persistent_storage = persistent_storage
+        self.settings = settings
+        self.pubsub = pubsub
 
         super().__init__()
 
     async def set_reconnecting_status(self, reconnecting: bool):
         await self.memory_storage.set("reconnecting", reconnecting)
+        await self.pubsub.send(Topic.CONNECTION_STATE, not reconnecting)
 
         if reconnecting:
             self.controls.append(self.reconnecting_status)
@@ -31,8 +36,7 @@ class StatusColumn(ft.Column):
             if self.reconnecting_status in self.controls:
                 self.controls.remove(self.reconnecting_status)
 
-            channel = await self.persistent_storage.get("channel")
-            if channel:
+            if channel := self.settings.channel:
                 websocket = await self.memory_storage.get("websocket")
                 await websocket.join_channel(channel)
 
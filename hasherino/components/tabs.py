@@ -6,9 +6,12 @@ import flet as ft
 
 from hasherino.api import helix
 from hasherino.api.chat_history import get_chat_history
-from hasherino.api.seven_tv import SevenTV
+from hasherino.api.seven_tv import SevenTV, emote_from_gql
+from hasherino.badge_index import BadgeIndex
 from hasherino.hasherino_dataclasses import Emote
 from hasherino.parse_irc import ParsedMessage
+from hasherino.pubsub import PubSub, Topic
+from hasherino.settings import Settings
 from hasherino.storage import AsyncKeyValueStorage
 from hasherino.twitch_websocket import TwitchWebsocket
 
@@ -19,46 +22,51 @@ class HasherinoTab(ft.Tab):
         channel: str,
         persistent_storage: AsyncKeyValueStorage,
         memory_storage: AsyncKeyValueStorage,
+        settings: Settings,
         message_received: Awaitable[ParsedMessage],
+        pubsub: PubSub,
     ):
         super().__init__(tab_content=ft.Row(controls=[ft.Text(channel)]))
         self.persistent_storage = persistent_storage
+        self.settings = settings
         self.memory_storage = memory_storage
+        self.pubsub = pubsub
         self.channel = channel
         self.message_received = message_received
-
-    async def _get_channel_seventv_emotes(self, user: helix.TwitchUser) -> dict:
+        # Active 7TV emote set of the channel, followed for live changes
+        self.seventv_emote_set_id: str | None = None
+        # Channel login the emote set is followed for
+        self.seventv_login: str | None = None
+
+    async def _get_channel_seventv_emotes(
+        self, user: helix.TwitchUser
+    ) -> dict[str, Emote]:
         try:
-            seventv_user = await SevenTV.get_user(user.id)
+            active_ttv_set = await SevenTV.get_active_emote_set(user.id)
 
-            if not seventv_user:
+            if not active_ttv_set:
                 return dict()
 
-            ttv_connection = next(
-                connection
-                for connection in seventv_user["connections"]
-                if connection["platform"] == "TWITCH"
-            )
-            active_ttv_set = next(
-                ttv_set
-                for ttv_set in seventv_user["emote_sets"]
-                if ttv_set["id"] == ttv_connection["emote_set_id"]
-            )
             logging.info(
                 f"Loaded {len(active_ttv_set['emotes'])} channel 7tv emotes for {self.channel}"
             )
+            self.seventv_emote_set_id = active_ttv_set["id"]
             return {
-                emote["name"]: emote["data"]["id"] for emote in active_ttv_set["emotes"]
+                emote["name"]: emote_from_gql(emote)
+                for emote in active_ttv_set["emotes"]
             }
         except Exception as e:
             raise Exception(
                 f"Failed to load channel 7tv emotes for {self.channel} with error {e}"
             ) from e
 
-    async def _get_global_7tv_emotes(self) -> dict[str, str]:
+    async def _get_global_7tv_emotes(self) -> dict[str, Emote]:
         try:
             global_emotes = await SevenTV.get_global_emote_set()
-            return {emote["name"]: emote["id"] for emote in global_emotes["emotes"]}
+            return {
+                emote["name"]: emote_from_gql(emote)
+                for emote in global_emotes["emotes"]
+            }
         except Exception as e:
             raise Exception("Failed to load global 7tv emotes with error {e}") from e
 
@@ -72,14 +80,20 @@ class HasherinoTab(ft.Tab):
                 f"Failed to load ttv emotes for {self.channel} with error {e}"
             ) from e
 
-    async def load_emotes(self):
+    async def _load_channel_badges(
+        self, app_id: str, helix_token: str, user: helix.TwitchUser
+    ):
+        # Missing channel badges shouldn't keep the emotes from loading
         try:
-            async with asyncio.TaskGroup() as tg:
-                app_id_task = tg.create_task(self.persistent_storage.get("app_id"))
-                helix_token_task = tg.create_task(self.persistent_storage.get("token"))
+            badge_index: BadgeIndex = await self.memory_storage.get("badge_index")
+            await badge_index.load_room(app_id, helix_token, str(user.id), user.login)
+        except Exception as e:
+            logging.error(f"Failed to load badges for {self.channel} with error {e}")
 
-            app_id = await app_id_task
-            token = await helix_token_task
+    async def load_emotes(self):
+        try:
+            app_id = self.settings.app_id
+            token = await self.persistent_storage.get("token")
 
             user: helix.TwitchUser = (
                 await helix.get_users(
@@ -94,30 +108,70 @@ class HasherinoTab(ft.Tab):
                     self._get_channel_seventv_emotes(user)
                 )
                 stv_global_emotes_task = tg.create_task(self._get_global_7tv_emotes())
+                tg.create_task(self._load_channel_badges(app_id, token, user))
 
-            seventv_emotes = await stv_channel_emotes_task
-            seventv_emotes.update(await stv_global_emotes_task)
+            # Channel emotes shadow global ones of the same name
+            global_emotes = await stv_global_emotes_task
+            seventv_emotes = global_emotes | await stv_channel_emotes_task
+            await self.memory_storage.set("7tv_global_emotes", global_emotes)
 
             if not (emotes := await self.memory_storage.get("7tv_emotes")):
                 emotes = dict()
 
-            emotes[user.login] = {
-                emote_name: Emote(
-                    emote_name,
-                    emote_id,
-                    f"https://cdn.7tv.app/emote/{emote_id}/2x.webp",
-                )
-                for emote_name, emote_id in seventv_emotes.items()
-            }
+            emotes[user.login] = seventv_emotes
             await self.memory_storage.set("7tv_emotes", emotes)
+            await self.pubsub.send(Topic.EMOTES_RELOADED, user.login)
+
+            if self.seventv_emote_set_id:
+                await self.follow_seventv_emote_set(user.login)
 
         except Exception as e:
             logging.error(f"Error while loading emotes: {e}")
 
+    async def follow_seventv_emote_set(self, login: str):
+        emote_set_ids = await self.memory_storage.get("7tv_emote_set_ids") or {}
+        emote_set_ids[login] = self.seventv_emote_set_id
+        await self.memory_storage.set("7tv_emote_set_ids", emote_set_ids)
+        self.seventv_login = login
+
+        if seventv_events := await self.memory_storage.get("seventv_events"):
+            await seventv_events.subscribe(self.seventv_emote_set_id)
+
+    async def unfollow_seventv_emote_set(self):
+        if not self.seventv_login:
+            return
+
+        # Other channels may use the same set, only this one stops following it
+        emote_set_ids: dict = await self.memory_storage.get("7tv_emote_set_ids") or {}
+        emote_set_ids.pop(self.seventv_login, None)
+        await self.memory_storage.set("7tv_emote_set_ids", emote_set_ids)
+        self.seventv_login = None
+
+        if seventv_events := await self.memory_storage.get("seventv_events"):
+            await seventv_events.unsubscribe(self.seventv_emote_set_id)
+
+    async def prefetch_emotes(self):
+        prefetcher = await self.memory_storage.get("emote_prefetcher")
+        if not prefetcher:
+            return
+
+        channel_emotes: dict[str, Emote] = dict()
+        channel_emotes.update(await self.memory_storage.get("ttv_emote_sets") or {})
+        channel_emotes.update(
+            (await self.memory_storage.get("7tv_emotes") or {}).get(self.channel, {})
+        )
+        prefetcher.prefetch_channel(
+            self.channel,
+            channel_emotes.values(),
+            self.settings.chat_font_size,
+            self.settings.device_pixel_ratio,
+        )
+
     async def load_history(self):
-        if await self.persistent_storage.get("chat_history"):
-            limit = int(await self.persistent_storage.get("max_messages_per_chat"))
-            for message in await get_chat_history(self.channel, limit):
+        if self.settings.chat_history:
+            for message in await get_chat_history(
+                self.channel, self.settings.max_messages_per_chat
+            ):
                 await self.message_received(message)
 
 
@@ -126,6 +180,8 @@ class Tabs(ft.Tabs):
         self,
         memory_storage: AsyncKeyValueStorage,
         persistent_storage: AsyncKeyValueStorage,
+        settings: Settings,
+        pubsub: PubSub,
     ):
         super().__init__(
             tabs=[],
@@ -133,13 +189,26 @@ class Tabs(ft.Tabs):
         )
         self.memory_storage = memory_storage
         self.persistent_storage = persistent_storage
+        self.settings = settings
+        self.pubsub = pubsub
 
     async def add_tab(self, channel: str, message_received: Awaitable[ParsedMessage]):
+        # The tabs are replaced, they stop following their channel's emote set before the
+        # new one starts following its own, which may be the same
+        for old_tab in self.tabs:
+            await old_tab.unfollow_seventv_emote_set()
+
         tab = HasherinoTab(
-            channel, self.persistent_storage, self.memory_storage, message_received
+            channel,
+            self.persistent_storage,
+            self.memory_storage,
+            self.settings,
+            message_received,
+            self.pubsub,
         )
         await tab.load_emotes()
         await tab.load_history()
+        await tab.prefetch_emotes()
         close_button = ft.IconButton(icon=ft.icons.CLOSE, on_click=self.close)
         close_button.parent_tab = tab
         tab.tab_content.controls.append(close_button)
@@ -151,8 +220,9 @@ class Tabs(ft.Tabs):
         websocket: TwitchWebsocket = await self.memory_storage.get("websocket")
         tab_channel = button_click.control.parent_tab.channel
         await websocket.leave_channel(tab_channel)
+        await button_click.control.parent_tab.unfollow_seventv_emote_set()
         self.tabs.remove(button_click.control.parent_tab)
-        await self.persistent_storage.set("channel", None)
+        await self.settings.update("channel", None)
         logging.info(f"Closed tab {tab_channel}")
         await self.page.add_async()
 
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Iterable
+
+from hasherino.asset_urls import emote_height, emote_url
+from hasherino.hasherino_dataclasses import Emote
+from hasherino.image_cache import ImageCache
+from hasherino.storage import AsyncKeyValueStorage
+
+__all__ = ["EmotePrefetcher"]
+
+
+class EmotePrefetcher:
+    """
+    Warms the image cache with a channel's emotes in the background, most used first.
+
+    Usage is counted per channel and persisted, so the ranking carries over between runs.
+    Prefetching only runs while the network is otherwise idle: it backs off while the
+    image cache is downloading images for visible messages or the user is typing.
+    """
+
+    def __init__(
+        self,
+        image_cache: ImageCache,
+        persistent_storage: AsyncKeyValueStorage,
+        max_concurrent: int = 2,
+        idle_delay: float = 2.0,
+        max_emotes: int = 300,
+        save_interval: float = 60.0,
+    ) -> None:
+        self.image_cache = image_cache
+        self.persistent_storage = persistent_storage
+        self.max_concurrent = max_concurrent
+        self.idle_delay = idle_delay
+        self.max_emotes = max_emotes
+        self.save_interval = save_interval
+
+        self.usage: dict[str, Counter] = {}
+        self.uses = 0
+        self.prefetch_hits = 0
+
+        self._prefetched: set[str] = set()
+        self._last_activity = 0.0
+        self._usage_changed = False
+        self._task: asyncio.Task | None = None
+        self._save_task: asyncio.Task | None = None
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Fraction of emote uses whose image had been prefetched.
+        """
+        return self.prefetch_hits / self.uses if self.uses else 0.0
+
+    async def load(self):
+        usage = await self.persistent_storage.get("emote_usage") or {}
+        self.usage = {channel: Counter(counts) for channel, counts in usage.items()}
+        self._save_task = asyncio.create_task(self._save_periodically())
+
+    def notify_activity(self):
+        """
+        Called on user input, postpones prefetching for idle_delay seconds.
+        """
+        self._last_activity = time.monotonic()
+
+    def record_usage(self, channel: str, emotes: Iterable[Emote]):
+        counter = self.usage.setdefault(channel, Counter())
+
+        for emote in emotes:
+            counter[emote.id] += 1
+            self.uses += 1
+
+            if emote.id in self._prefetched:
+                self.prefetch_hits += 1
+
+            self._usage_changed = True
+
+    def prefetch_channel(
+        self,
+        channel: str,
+        emotes: Iterable[Emote],
+        font_size: float,
+        pixel_ratio: float = 1.0,
+    ):
+        """
+        Starts prefetching a channel's emotes at the rendition used for font_size,
+        replacing any prefetch already running.
+        """
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+        urls = {
+            emote.id: emote_url(emote, emote_height(font_size), pixel_ratio)
+            for emote in emotes
+        }
+        self._task = asyncio.create_task(self._prefetch(channel, urls))
+
+    def _is_busy(self) -> bool:
+        user_active = time.monotonic() - self._last_activity < self.idle_delay
+        return user_active or self.image_cache.pending_downloads > 0
+
+    async def _fetch(self, semaphore: asyncio.Semaphore, emote_id: str, url: str):
+        async with semaphore:
+            while self._is_busy():
+                await asyncio.sleep(self.idle_delay)
+
+            # Through the image cache's pending downloads, so a message showing the emote
+            # meanwhile joins this download instead of starting another one
+            if download := self.image_cache.prefetch(url, background=True):
+                # Shielded, cancelling the prefetch mustn't cancel a download others joined
+                path = await asyncio.shield(download)
+            else:
+                path = self.image_cache.get_path(url)
+
+            if path:
+                self._prefetched.add(emote_id)
+
+    async def _prefetch(self, channel: str, urls: dict[str, str]):
+        """
+        urls maps emote ids to the URL to prefetch for them.
+        """
+        counter = self.usage.get(channel, Counter())
+        ranked = sorted(urls, key=lambda emote_id: counter[emote_id], reverse=True)
+        ranked = [
+            emote_id
+            for emote_id in ranked[: self.max_emotes]
+            if self.image_cache.get_path(urls[emote_id]) is None
+        ]
+
+        logging.info(f"Prefetching {len(ranked)} emotes for {channel}")
+
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with asyncio.TaskGroup() as tg:
+            for emote_id in ranked:
+                tg.create_task(self._fetch(semaphore, emote_id, urls[emote_id]))
+
+        logging.info(
+            f"Finished prefetching emotes for {channel}. Prefetch hit rate: {self.hit_rate:.2%}, "
+            f"image cache hit rate: {self.image_cache.hit_rate:.2%}"
+        )
+
+    async def _save_periodically(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await self.save()
+
+    async def save(self):
+        if not self._usage_changed:
+            return
+
+        self._usage_changed = False
+
+        # Only the top of each ranking matters, don't let the stored counters grow forever
+        await self.persistent_storage.set(
+            "emote_usage",
+            {
+                channel: dict(counter.most_common(self.max_emotes))
+                for channel, counter in self.usage.items()
+            },
+        )
@@ -0,0 +1,89 @@
+import logging
+import time
+from typing import Iterable
+
+from hasherino.api import helix
+from hasherino.api.helix import Priority
+from hasherino.hasherino_dataclasses import Emote
+from hasherino.storage import SqliteStorage
+
+__all__ = ["EmoteSetCatalog"]
+
+
+class EmoteSetCatalog:
+    """
+    Twitch emotes of every emote set seen so far, persisted by emote set id.
+
+    A user's emote sets rarely change, so after the first run only sets that are new, or
+    older than max_age, have to be fetched from helix.
+    """
+
+    def __init__(
+        self, storage: SqliteStorage, max_age: float = 7 * 24 * 60 * 60
+    ) -> None:
+        self.storage = storage
+        self.max_age = max_age
+
+        # Emote set id -> {"fetched_at": timestamp, "emotes": [helix emote fields]}
+        self._sets: dict[str, dict] = {}
+
+    async def load(self):
+        self._sets = dict(await self.storage.range())
+        logging.info(f"Loaded {len(self._sets)} cached emote sets")
+
+    def emotes(self, set_ids: Iterable[str]) -> dict[str, Emote]:
+        """
+        Emotes of the given sets that are in the catalog, by name.
+        """
+        return {
+            emote["name"]: helix.emote_from_helix(emote)
+            for set_id in set_ids
+            if set_id in self._sets
+            for emote in self._sets[set_id]["emotes"]
+        }
+
+    def outdated(self, set_ids: Iterable[str]) -> set[str]:
+        """
+        Sets missing from the catalog or older than max_age.
+        """
+        now = time.time()
+        return {
+            set_id
+            for set_id in set_ids
+            if set_id not in self._sets
+            or now - self._sets[set_id]["fetched_at"] > self.max_age
+        }
+
+    async def update(self, app_id: str, oauth_token: str, set_ids: Iterable[str]):
+        """
+        Fetches the outdated sets among set_ids. Returns whether the catalog changed.
+        """
+        if not (outdated := self.outdated(set_ids)):
+            return False
+
+        logging.debug(f"Fetching {len(outdated)} emote sets")
+        result = await helix.get_all_emote_sets(
+            app_id, oauth_token, outdated, Priority.LOW
+        )
+
+        # Sets of failed requests are left out, so they're fetched again next time
+        failed = {value for chunk in result.failed for _, value in chunk}
+        fetched = {
+            set_id: {"fetched_at": time.time(), "emotes": []}
+            for set_id in outdated - failed
+        }
+
+        for emote in result.data:
+            if entry := fetched.get(emote["emote_set_id"]):
+                entry["emotes"].append(
+                    {
+                        key: emote[key]
+                        for key in ("id", "name", "format")
+                        if key in emote
+                    }
+                )
+
+        self._sets.update(fetched)
+        await self.storage.set_many(fetched)
+
+        return bool(fetched)
@@ -1,8 +1,51 @@
+from collections import OrderedDict
 from datetime import datetime
+from typing import Any, Callable
 
 from hasherino.hasherino_dataclasses import Emote, HasherinoUser, Message
 from hasherino.parse_irc import ParsedMessage
 
+_ELEMENT_CACHE_SIZE = 1024
+
+# LRU of tokenized message texts, keyed by (text, message emote ids, emote map version)
+_element_cache: OrderedDict[tuple, list[str | Emote]] = OrderedDict()
+_emote_map_version = 0
+
+
+async def on_emotes_reloaded(_: Any):
+    """
+    Emote maps changed, cached elements may resolve words differently now.
+    """
+    global _emote_map_version
+    _emote_map_version += 1
+    _element_cache.clear()
+
+
+def _get_elements(
+    text: str,
+    message_emote_ids: frozenset,
+    get_emote_map: Callable[[], dict[str, Emote]],
+) -> list[str | Emote]:
+    """
+    Splits text into words and emotes, get_emote_map is only called on cache misses.
+
+    The returned list is shared between messages with the same text, so it must not be modified.
+    """
+    key = (text, message_emote_ids, _emote_map_version)
+
+    if (elements := _element_cache.get(key)) is not None:
+        _element_cache.move_to_end(key)
+        return elements
+
+    emote_map = get_emote_map()
+    elements = [emote_map.get(word, word) for word in text.split(" ")]
+    _element_cache[key] = elements
+
+    if len(_element_cache) > _ELEMENT_CACHE_SIZE:
+        _element_cache.popitem(last=False)
+
+    return elements
+
 
 def message_factory(
     user: HasherinoUser,
@@ -16,9 +59,7 @@ def message_factory(
     When it's a ParsedMessage, it's being built from a received message, so we need to get twitch emote information from the ParsedMessage.
     """
     if isinstance(message, str):
-        elements: list[str | Emote] = [
-            emote_map.get(word, word) for word in message.split(" ")
-        ]
+        elements = _get_elements(message, frozenset(), lambda: emote_map)
         return Message(
             user=user,
             elements=elements,
@@ -27,17 +68,20 @@ def message_factory(
             timestamp=datetime.now(),
         )
     elif isinstance(message, ParsedMessage):
-        emote_map = emote_map.copy()
-        emote_map.update(message.get_emote_map())
-        elements: list[str | Emote] = [
-            emote_map.get(word, word) for word in message.get_message_text().split(" ")
-        ]
+        elements = _get_elements(
+            message.get_message_text(),
+            # Twitch emotes in the message tags depend on the sender
+            frozenset((message.tags or {}).get("emotes") or ()),
+            lambda: emote_map | message.get_emote_map(),
+        )
+
         return Message(
             user=user,
             elements=elements,
             message_type="chat_message",
             me=message.is_me(),
             timestamp=message.get_timestamp(),
+            historical=message.is_historical(),
         )
     else:
         raise TypeError("The message parameter can only be an str or ParsedMessage.")
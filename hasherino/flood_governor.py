@@ -0,0 +1,121 @@
+import logging
+import time
+from enum import IntEnum
+
+__all__ = ["FloodGovernor", "FloodLevel"]
+
+
+class FloodLevel(IntEnum):
+    NORMAL = 0
+    # Text only lines, no badges or emote images
+    CONDENSED = 1
+    # Condensed lines, and only up to sampled_rate of them per second are shown
+    SAMPLED = 2
+
+
+class FloodGovernor:
+    """
+    Decides how incoming messages are rendered from the incoming message rate and how long
+    UI updates take.
+
+    The level goes up as soon as a threshold is crossed and only goes down one level after
+    load stays under half the threshold for recovery_time seconds, so it doesn't flap.
+    """
+
+    def __init__(
+        self,
+        condensed_rate: float = 150,
+        sampled_rate: float = 300,
+        latency_budget: float = 0.25,
+        max_sampled_rate: float = 50,
+        recovery_time: float = 5.0,
+    ) -> None:
+        """
+        Rates are in messages per second, latency_budget is in seconds per UI update.
+        """
+        self.condensed_rate = condensed_rate
+        self.sampled_rate = sampled_rate
+        self.latency_budget = latency_budget
+        self.max_sampled_rate = max_sampled_rate
+        self.recovery_time = recovery_time
+
+        self.level = FloodLevel.NORMAL
+        self.received = 0
+        self.skipped = 0
+
+        self._backlog = 0
+        self._last_frame = time.monotonic()
+        self._calm_since: float | None = None
+        # Token bucket limiting lines shown per second while sampling
+        self._tokens = max_sampled_rate
+        self._last_refill = time.monotonic()
+
+    def should_render(self) -> bool:
+        """
+        Called for every received message, returns False for messages sampled out.
+        """
+        self.received += 1
+        self._backlog += 1
+
+        if self.level < FloodLevel.SAMPLED:
+            return True
+
+        now = time.monotonic()
+        self._tokens = min(
+            self.max_sampled_rate,
+            self._tokens + (now - self._last_refill) * self.max_sampled_rate,
+        )
+        self._last_refill = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def on_frame(self, latency: float):
+        """
+        Called after every UI update with how long it took.
+        """
+        now = time.monotonic()
+        rate = self._backlog / max(now - self._last_frame, 1e-3)
+        self._backlog = 0
+        self._last_frame = now
+
+        if rate > self.sampled_rate or (
+            latency > self.latency_budget and self.level == FloodLevel.CONDENSED
+        ):
+            target = FloodLevel.SAMPLED
+        elif rate > self.condensed_rate or latency > self.latency_budget:
+            target = FloodLevel.CONDENSED
+        else:
+            target = FloodLevel.NORMAL
+
+        if target > self.level:
+            self._set_level(target, rate, latency)
+            self._calm_since = None
+            return
+
+        calm = (
+            rate < self._rate_threshold(self.level) / 2
+            and latency < self.latency_budget / 2
+        )
+
+        if not calm or self.level == FloodLevel.NORMAL:
+            self._calm_since = None
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= self.recovery_time:
+            self._set_level(FloodLevel(self.level - 1), rate, latency)
+            self._calm_since = None
+
+    def _rate_threshold(self, level: FloodLevel) -> float:
+        return self.sampled_rate if level == FloodLevel.SAMPLED else self.condensed_rate
+
+    def _set_level(self, level: FloodLevel, rate: float, latency: float):
+        logging.info(
+            f"Flood level {self.level.name} -> {level.name}. {rate:.0f} messages/s, "
+            f"UI update took {latency:.3f}s. Received {self.received}, skipped {self.skipped}"
+        )
+        self.level = level
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 
@@ -8,6 +8,8 @@ class Badge:
     id: str
     name: str
     url: str
+    # 1x, 2x and 4x renditions, see asset_urls.badge_url
+    urls: tuple[str, ...] = field(default_factory=tuple)
 
 
 @dataclass
@@ -26,7 +28,11 @@ class EmoteSource(Enum):
 class Emote:
     name: str
     id: str
-    url: str
+    source: EmoteSource = EmoteSource.TWITCH
+    # Size of the 1x rendition in pixels, used to lay the emote out before its image loads
+    width: int | None = None
+    height: int | None = None
+    animated: bool = False
 
 
 @dataclass
@@ -36,3 +42,5 @@ class Message:
     message_type: str
     me: bool
     timestamp: datetime | None = None
+    # Replayed from the chat history service instead of received live
+    historical: bool = False
@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import time
+from pathlib import Path
+
+from hasherino.api import http_client
+
+__all__ = ["ImageCache"]
+
+
+class ImageCache:
+    """
+    Content-addressed on-disk cache for emote and badge images.
+
+    Images are stored as <sha256 of the content><extension>, so the same image reached
+    through different URLs(e.g. the same emote in different channels) is stored once.
+    An index maps URLs to files and tracks each file's last access for LRU eviction
+    once the cache grows past max_size bytes.
+    """
+
+    _INDEX_FILE = "index.json"
+
+    def __init__(
+        self,
+        directory: Path,
+        max_size: int = 200 * 1024 * 1024,
+        max_concurrent_downloads: int = 8,
+        index_save_delay: float = 5.0,
+    ) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.index_save_delay = index_save_delay
+
+        self.hits = 0
+        self.misses = 0
+
+        # URL -> file name
+        self._urls: dict[str, str] = {}
+        # File name -> {"size": bytes, "last_access": unix time}
+        self._files: dict[str, dict] = {}
+        self._total_size = 0
+
+        self._pending: dict[str, asyncio.Task] = {}
+        # Pending URLs only background prefetching asked for, nothing shows them yet
+        self._background: set[str] = set()
+        # File name -> write in progress, its size is already counted in _total_size
+        self._writes: dict[str, asyncio.Task] = {}
+        # URLs that failed to download this session, not retried until restart
+        self._failed: set[str] = set()
+        self._download_semaphore = asyncio.Semaphore(max_concurrent_downloads)
+        self._save_task: asyncio.Task | None = None
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def pending_downloads(self) -> int:
+        """
+        Downloads of images something is waiting to show, background prefetches excluded.
+        """
+        return len(self._pending) - len(self._background)
+
+    async def load(self):
+        """
+        Reads the index from disk, dropping entries whose files are gone.
+        """
+
+        def read_index() -> dict:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            index_path = self.directory / self._INDEX_FILE
+
+            try:
+                with open(index_path, "r") as file:
+                    return json.load(file)
+            except FileNotFoundError:
+                return {}
+            except json.JSONDecodeError:
+                logging.warning(
+                    f"Image cache index {index_path} is corrupted, resetting"
+                )
+                return {}
+
+        index = await asyncio.to_thread(read_index)
+
+        self._files = {
+            name: info
+            for name, info in index.get("files", {}).items()
+            if (self.directory / name).is_file()
+        }
+        self._urls = {
+            url: name
+            for url, name in index.get("urls", {}).items()
+            if name in self._files
+        }
+        self._total_size = sum(info["size"] for info in self._files.values())
+
+        logging.info(
+            f"Loaded image cache with {len(self._files)} files, {self._total_size} bytes"
+        )
+
+    def get_path(self, url: str) -> Path | None:
+        """
+        Returns the cached file for url, if there is one.
+        """
+        name = self._urls.get(url)
+
+        if name is None:
+            return None
+
+        self._files[name]["last_access"] = time.time()
+        return self.directory / name
+
+    def resolve(self, url: str) -> str:
+        """
+        Returns a source flet can load for url: the cached file if there is one, otherwise
+        the remote url itself, in which case the image is downloaded in the background so
+        the next control showing it is served from disk.
+        """
+        if path := self.get_path(url):
+            self.hits += 1
+            return str(path)
+
+        self.misses += 1
+        self.prefetch(url)
+        return url
+
+    def prefetch(self, url: str, background: bool = False) -> asyncio.Task | None:
+        """
+        Starts downloading url unless it's cached or already being downloaded, in which
+        case the pending download is returned.
+
+        Background downloads don't count in pending_downloads, until a foreground prefetch
+        of the same url joins them.
+        """
+        if url in self._urls or url in self._failed:
+            return None
+
+        if url not in self._pending:
+            self._pending[url] = asyncio.create_task(self.fetch(url))
+            self._pending[url].add_done_callback(lambda _: self._download_done(url))
+
+            if background:
+                self._background.add(url)
+        elif not background:
+            self._background.discard(url)
+
+        return self._pending[url]
+
+    def _download_done(self, url: str):
+        self._pending.pop(url, None)
+        self._background.discard(url)
+
+    async def fetch(self, url: str) -> Path | None:
+        """
+        Downloads url into the cache and returns its path, or None if the download failed.
+        """
+        if path := self.get_path(url):
+            return path
+
+        async with self._download_semaphore:
+            try:
+                content, content_type = await self._download(url)
+            except Exception as e:
+                logging.warning(f"Failed to download image {url} to cache: {e}")
+                self._failed.add(url)
+                return None
+
+        extension = mimetypes.guess_extension(content_type or "") or ""
+        name = hashlib.sha256(content).hexdigest() + extension
+        path = self.directory / name
+
+        try:
+            await self._store(name, path, content)
+        except Exception as e:
+            logging.warning(f"Failed to write image {url} to cache: {e}")
+            return None
+
+        self._urls[url] = name
+        logging.debug(f"Cached image {url} as {name}")
+
+        await self._evict()
+        self._schedule_index_save()
+
+        return path
+
+    async def _store(self, name: str, path: Path, content: bytes):
+        if name in self._files:
+            self._files[name]["last_access"] = time.time()
+
+            # The same content is being written for another fetch, wait for it
+            if write := self._writes.get(name):
+                await asyncio.shield(write)
+            return
+
+        # Reserved before writing, so concurrent fetches of the same content count it once
+        self._files[name] = {"size": len(content), "last_access": time.time()}
+        self._total_size += len(content)
+        write = self._writes[name] = asyncio.create_task(
+            asyncio.to_thread(self._write_file, path, content)
+        )
+        write.add_done_callback(lambda _: self._writes.pop(name, None))
+
+        try:
+            await asyncio.shield(write)
+        except Exception:
+            if self._files.pop(name, None):
+                self._total_size -= len(content)
+            raise
+
+    async def _download(self, url: str) -> tuple[bytes, str | None]:
+        session = http_client.get_session()
+
+        async with session.get(url) as response:
+            if not response.ok:
+                raise Exception(f"Response status {response.status}")
+
+            return await response.read(), response.content_type
+
+    @staticmethod
+    def _write_file(path: Path, content: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+
+        with open(tmp_path, "wb") as file:
+            file.write(content)
+
+        os.replace(tmp_path, path)
+
+    async def _evict(self):
+        if self._total_size <= self.max_size:
+            return
+
+        evicted = []
+
+        for name, info in sorted(
+            self._files.items(), key=lambda item: item[1]["last_access"]
+        ):
+            if self._total_size <= self.max_size:
+                break
+
+            if name in self._writes:
+                continue
+
+            evicted.append(name)
+            self._total_size -= info["size"]
+
+        for name in evicted:
+            del self._files[name]
+
+        evicted_set = set(evicted)
+        self._urls = {
+            url: name for url, name in self._urls.items() if name not in evicted_set
+        }
+
+        def remove_files():
+            for name in evicted:
+                (self.directory / name).unlink(missing_ok=True)
+
+        await asyncio.to_thread(remove_files)
+        logging.debug(f"Evicted {len(evicted)} images from cache")
+
+    def _schedule_index_save(self):
+        # Coalesce index writes, many images are usually cached in a short burst
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_index_later())
+
+    async def _save_index_later(self):
+        await asyncio.sleep(self.index_save_delay)
+        await self.save_index()
+
+    async def save_index(self):
+        index = {
+            "urls": dict(self._urls),
+            "files": {name: dict(info) for name, info in self._files.items()},
+        }
+
+        def write_index():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            index_path = self.directory / self._INDEX_FILE
+            tmp_path = index_path.with_suffix(".tmp")
+
+            with open(tmp_path, "w") as file:
+                json.dump(index, file)
+
+            os.replace(tmp_path, index_path)
+
+        await asyncio.to_thread(write_index)
@@ -3,7 +3,7 @@ from collections import defaultdict
 from datetime import datetime
 from enum import Enum, auto
 
-from hasherino.hasherino_dataclasses import Badge, Emote
+from hasherino.hasherino_dataclasses import Badge, Emote, EmoteSource
 
 
 class Command(Enum):
@@ -32,32 +32,36 @@ class ParsedMessage:
             self.source = self._parse_source(raw_components["raw_source"])
             self.parameters = raw_components["raw_parameters"]
 
-    def get_badges(self, ttv_badges: dict) -> list[Badge]:
-        def get_badge(set_id: str, version: str) -> dict | None:
-            try:
-                id_match = next((s for s in ttv_badges if s["set_id"] == set_id))
-                version_match = next(
-                    (s for s in id_match["versions"] if s["id"] == version)
-                )
-                return version_match
-            except:
-                return None
+    def get_badges(self, badges: dict[str, dict[str, Badge]] | None) -> list[Badge]:
+        """
+        badges maps set ids to the badges of each version, see BadgeIndex.
+        """
+        if not self.tags or not self.tags.get("badges") or not badges:
+            return []
 
-        badges = []
+        return [
+            badges[set_id][version]
+            for set_id, version in self.tags["badges"].items()
+            if version in badges.get(set_id, {})
+        ]
 
-        if not self.tags or not self.tags.get("badges"):
-            return badges
+    def get_channel(self) -> str | None:
+        """
+        Login of the channel the message was sent to, without the leading #
+        """
+        if not self.command or not self.command.get("channel"):
+            return None
 
-        try:
-            for id, version in self.tags["badges"].items():
-                badge = get_badge(id, version)
-                if badge:
-                    badges.append(Badge(id, badge["title"], badge["image_url_4x"]))
-        except Exception as e:
-            logging.exception(f"Error {e}. Failed to get badges from message: {self}")
-            return []
+        return self.command["channel"].removeprefix("#")
+
+    def is_historical(self) -> bool:
+        return bool(self.tags and self.tags.get("historical"))
 
-        return badges
+    def get_room_id(self) -> str | None:
+        if not self.tags:
+            return None
+
+        return self.tags.get("room-id")
 
     def get_author_chat_color(self) -> str:
         result = "ffffff"
@@ -156,10 +160,9 @@ class ParsedMessage:
                 emote_name = self.get_message_text()[
                     first_starting_index : first_ending_index + 1
                 ]
+                # Twitch emotes are square, 28px at scale 1.0
                 emote_name_to_id_and_url[emote_name] = Emote(
-                    emote_name,
-                    emote_id,
-                    f"https://static-cdn.jtvnw.net/emoticons/v2/{emote_id}/default/dark/2.0",
+                    emote_name, emote_id, EmoteSource.TWITCH, width=28, height=28
                 )
 
         return emote_name_to_id_and_url
@@ -242,7 +245,10 @@ class ParsedMessage:
                 Included only if you request the /commands capability.
                 But it has no meaning without also including the /tags capability.
                 """
-                parsed_command = {"command": command_parts[0]}
+                parsed_command = {
+                    "command": command_parts[0],
+                    "channel": command_parts[1],
+                }
             case "ROOMSTATE":
                 """
                 Included only if you request the /commands capability.
@@ -348,6 +354,9 @@ class ParsedMessage:
                 case "user-id":
                     dict_parsed_tags["user-id"] = tag_value
 
+                case "room-id":
+                    dict_parsed_tags["room-id"] = tag_value
+
                 case "display-name":
                     dict_parsed_tags["display-name"] = tag_value
 
@@ -357,6 +366,10 @@ class ParsedMessage:
                 case "tmi-sent-ts":
                     dict_parsed_tags["tmi-sent-ts"] = tag_value
 
+                case "historical":
+                    # Added by the chat history service to the messages it replays
+                    dict_parsed_tags["historical"] = tag_value == "1"
+
                 case _:
                     pass
 
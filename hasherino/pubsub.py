@@ -1,16 +1,104 @@
-from typing import Any, Awaitable
+import asyncio
+import inspect
+import logging
+import time
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any, Awaitable, Callable
+
+Subscriber = Callable[[Any], Awaitable]
+
+
+class Topic(StrEnum):
+    FONT_SIZE = "font_size"
+    SHOW_TIMESTAMP = "show_timestamp"
+    LOW_POWER_MODE = "low_power_mode"
+    EMOTES_RELOADED = "emotes_reloaded"
+    CONNECTION_STATE = "connection_state"
+
+
+@dataclass
+class TopicStats:
+    deliveries: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        attempts = self.deliveries + self.failures + self.timeouts
+        return self.total_latency / attempts if attempts else 0.0
 
 
 class PubSub:
-    def __init__(self) -> None:
-        self.funcs: set[Awaitable] = set()
+    """
+    Topic based async event bus.
+
+    Subscriptions are weak references: subscribing doesn't keep the subscriber alive and
+    dead subscriptions are dropped on the next send. Plain functions and closures must be
+    kept alive by the caller, bound methods live as long as their instance.
+
+    Subscribers of a topic are awaited concurrently, an exception or timeout in one of them
+    is logged and doesn't stop delivery to the others.
+    """
+
+    def __init__(self, timeout: float = 5.0) -> None:
+        self.timeout = timeout
+        self._subscribers: dict[str, list[weakref.ref]] = defaultdict(list)
+        self.stats: dict[str, TopicStats] = defaultdict(TopicStats)
+
+    @staticmethod
+    def _make_ref(func: Subscriber) -> weakref.ref:
+        if inspect.ismethod(func):
+            return weakref.WeakMethod(func)
+        return weakref.ref(func)
+
+    def _live_subscribers(self, topic: str) -> list[Subscriber]:
+        refs = self._subscribers.get(topic, [])
+        funcs = [func for ref in refs if (func := ref()) is not None]
+
+        if len(funcs) != len(refs):
+            self._subscribers[topic] = [ref for ref in refs if ref() is not None]
+
+        return funcs
+
+    async def subscribe(self, topic: str, func: Subscriber):
+        if func not in self._live_subscribers(topic):
+            self._subscribers[topic].append(self._make_ref(func))
+
+    async def subscribe_all(self, topic: str, funcs: list[Subscriber]):
+        for func in funcs:
+            await self.subscribe(topic, func)
+
+    async def unsubscribe(self, topic: str, func: Subscriber):
+        self._subscribers[topic] = [
+            ref for ref in self._subscribers[topic] if ref() not in (None, func)
+        ]
+
+    async def _deliver(self, topic: str, func: Subscriber, message: Any):
+        stats = self.stats[topic]
+        start = time.perf_counter()
 
-    async def subscribe(self, func: Awaitable):
-        self.funcs.add(func)
+        try:
+            async with asyncio.timeout(self.timeout):
+                await func(message)
+            stats.deliveries += 1
+        except TimeoutError:
+            stats.timeouts += 1
+            logging.warning(f"Subscriber {func} of topic {topic} timed out")
+        except Exception as e:
+            stats.failures += 1
+            logging.exception(f"Subscriber {func} of topic {topic} failed: {e}")
+        finally:
+            latency = time.perf_counter() - start
+            stats.total_latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
 
-    async def subscribe_all(self, funcs: list[Awaitable]):
-        self.funcs.update(funcs)
+    async def send(self, topic: str, message: Any):
+        funcs = self._live_subscribers(topic)
+        logging.debug(f"Sending {topic} to {len(funcs)} subscribers")
 
-    async def send(self, message: Any):
-        for func in self.funcs:
-            await func(message)
+        await asyncio.gather(*(self._deliver(topic, func, message) for func in funcs))
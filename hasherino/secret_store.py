@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+
+import keyring
+
+__all__ = ["SecretStore"]
+
+
+class SecretStore:
+    """
+    Keyring backed secrets cached in memory.
+
+    Keyring calls can take hundreds of milliseconds on some backends, so they run in a
+    worker thread and every secret is read from the keyring at most once.
+    """
+
+    def __init__(self, service: str = "hasherino") -> None:
+        self.service = service
+        self._cache: dict[str, str | None] = {}
+        self._expires_at: dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, name: str) -> str | None:
+        if name in self._cache:
+            return self._cache[name]
+
+        async with self._lock:
+            # Another task may have read it while this one waited
+            if name not in self._cache:
+                self._cache[name] = await asyncio.to_thread(
+                    keyring.get_password, self.service, name
+                )
+
+        return self._cache[name]
+
+    async def set(self, name: str, value: str):
+        async with self._lock:
+            self._cache.pop(name, None)
+            self._expires_at.pop(name, None)
+
+            await asyncio.to_thread(keyring.set_password, self.service, name, value)
+            self._cache[name] = value
+
+        # DO NOT log passwords
+        logging.debug(f"Secret {name} updated")
+
+    def set_expiry(self, name: str, expires_in: float):
+        """
+        Records that the secret expires in expires_in seconds from now.
+        """
+        self._expires_at[name] = time.time() + expires_in
+        logging.debug(f"Secret {name} expires in {expires_in:.0f}s")
+
+    def expires_in(self, name: str) -> float | None:
+        """
+        Seconds until the secret expires, None if unknown.
+        """
+        if name not in self._expires_at:
+            return None
+
+        return self._expires_at[name] - time.time()
+
+    def is_expired(self, name: str) -> bool:
+        expires_in = self.expires_in(name)
+        return expires_in is not None and expires_in <= 0
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+from dataclasses import asdict, dataclass, fields
+from enum import StrEnum
+from typing import Any
+
+from hasherino.pubsub import PubSub, Topic
+from hasherino.storage import AsyncKeyValueStorage
+
+__all__ = ["LowPowerMode", "Settings"]
+
+
+class LowPowerMode(StrEnum):
+    OFF = "Off"
+    ON = "On"
+    AUTOMATIC = "Automatic"
+
+
+# Settings whose changes are published, and the topic they're published on
+_TOPICS = {
+    "chat_font_size": Topic.FONT_SIZE,
+    "show_timestamp": Topic.SHOW_TIMESTAMP,
+    "low_power_mode": Topic.LOW_POWER_MODE,
+}
+
+# Inclusive (min, max) of numeric settings
+_LIMITS = {
+    "chat_font_size": (10, 50),
+    "chat_update_rate": (0.3, 1.0),
+    "max_messages_per_chat": (10, 500),
+}
+
+
+@dataclass
+class Settings:
+    """
+    User settings, loaded once from persistent storage and kept in memory.
+
+    Reads are plain attribute accesses. Changes go through update, which validates the
+    value, publishes it on its topic and persists it in the background.
+    """
+
+    app_id: str = ""
+    channel: str | None = None
+    chat_font_size: int = 18
+    chat_history: bool = True
+    chat_update_rate: float = 0.5
+    collapse_duplicates: bool = False
+    color_switcher: bool = False
+    # flet doesn't report the device pixel ratio, so it can be set manually
+    device_pixel_ratio: float = 1.0
+    low_power_mode: LowPowerMode = LowPowerMode.AUTOMATIC
+    max_messages_per_chat: int = 100
+    show_timestamp: bool = True
+    theme: str = "System"
+    user_id: str | None = None
+    user_name: str | None = None
+    window_height: int = 800
+    window_width: int = 500
+
+    def __post_init__(self):
+        self._storage: AsyncKeyValueStorage | None = None
+        self._pubsub: PubSub | None = None
+        self._pending: dict[str, Any] = {}
+        self._save_task: asyncio.Task | None = None
+
+    @classmethod
+    async def load(
+        cls, storage: AsyncKeyValueStorage, pubsub: PubSub | None = None
+    ) -> "Settings":
+        """
+        Reads every setting from storage. Missing or invalid values keep their default.
+        """
+        settings = cls()
+        settings._storage = storage
+        settings._pubsub = pubsub
+
+        stored = await storage.get_many(field.name for field in fields(cls))
+
+        for name, value in stored.items():
+            if value is None:
+                continue
+
+            try:
+                setattr(settings, name, settings._validate(name, value))
+            except ValueError:
+                logging.warning(f"Ignoring invalid stored setting {name}: {value}")
+
+        return settings
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    def _validate(self, name: str, value: Any) -> Any:
+        """
+        Converts value to the type of the setting, raises ValueError if it can't be or
+        it's out of range.
+        """
+        default = getattr(type(self), name, None)
+
+        if name not in {field.name for field in fields(self)}:
+            raise ValueError(f"Unknown setting {name}")
+
+        if value is None:
+            if default is not None:
+                raise ValueError(f"Setting {name} can't be empty")
+            return None
+
+        match default:
+            case bool():
+                value = bool(value)
+            case LowPowerMode():
+                value = LowPowerMode(value)
+            case int():
+                value = int(float(value))
+            case float():
+                value = float(value)
+            case _:
+                value = str(value)
+
+        if name in _LIMITS:
+            low, high = _LIMITS[name]
+            if not low <= value <= high:
+                raise ValueError(f"Setting {name} must be between {low} and {high}")
+
+        return value
+
+    async def update(self, name: str, value: Any):
+        await self.update_many({name: value})
+
+    async def update_many(self, values: dict[str, Any]):
+        """
+        Validates and applies the values, raising ValueError without changing anything if
+        one of them is invalid. Changed settings are published and persisted.
+        """
+        validated = {
+            name: self._validate(name, value) for name, value in values.items()
+        }
+        changed = {
+            name: value
+            for name, value in validated.items()
+            if getattr(self, name) != value
+        }
+
+        for name, value in changed.items():
+            setattr(self, name, value)
+            logging.debug(f"Setting {name} changed to {value}")
+
+        if self._storage and changed:
+            self._pending.update(changed)
+            if self._save_task is None or self._save_task.done():
+                self._save_task = asyncio.create_task(self.save())
+
+        if self._pubsub:
+            for name, value in changed.items():
+                if topic := _TOPICS.get(name):
+                    await self._pubsub.send(topic, value)
+
+    async def save(self):
+        """
+        Writes the settings changed since the last save.
+        """
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            await self._storage.set_many(pending)
+
+    async def flush(self):
+        """
+        Waits until every change is written to storage.
+        """
+        if self._save_task is not None and not self._save_task.done():
+            await self._save_task
+
+        await self.save()
@@ -1,15 +1,20 @@
 import asyncio
 import json
 import logging
+import os
+import sqlite3
 import sys
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from io import TextIOBase
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator, Callable, Iterable
 
-import keyring
 from flet import Page
 
+from hasherino.secret_store import SecretStore
+
 
 def get_default_os_settings_path() -> Path:
     """
@@ -39,6 +44,62 @@ class AsyncKeyValueStorage(ABC):
     async def remove(self, key):
         pass
 
+    async def close(self):
+        pass
+
+    async def get_many(self, keys: Iterable) -> dict[Any, Any]:
+        """
+        Returns a dict with the value of every key, None for missing keys.
+        """
+        return {key: await self.get(key) for key in keys}
+
+    async def set_many(self, items: dict):
+        await self._commit(items, ())
+
+    async def _commit(self, writes: dict, removals: Iterable):
+        """
+        Applies the writes and removals of a transaction. Backends override this to apply
+        them at once.
+        """
+        for key, value in writes.items():
+            await self.set(key, value)
+
+        for key in removals:
+            await self.remove(key)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator["StorageTransaction"]:
+        """
+        Buffers the sets and removes made through the yielded transaction and applies them
+        together on exit, or drops them if the block raises.
+        """
+        transaction = StorageTransaction(self)
+        yield transaction
+        await self._commit(transaction.writes, transaction.removals)
+
+
+class StorageTransaction:
+    def __init__(self, storage: AsyncKeyValueStorage) -> None:
+        self.storage = storage
+        self.writes: dict = {}
+        self.removals: set = set()
+
+    async def get(self, key) -> Any:
+        # Reads see the transaction's own changes
+        if key in self.writes:
+            return self.writes[key]
+        if key in self.removals:
+            return None
+        return await self.storage.get(key)
+
+    async def set(self, key, value):
+        self.removals.discard(key)
+        self.writes[key] = value
+
+    async def remove(self, key):
+        self.writes.pop(key, None)
+        self.removals.add(key)
+
 
 class MemoryOnlyStorage(AsyncKeyValueStorage):
     def __init__(self, page: Page) -> None:
@@ -57,37 +118,75 @@ class MemoryOnlyStorage(AsyncKeyValueStorage):
         logging.debug(f"Memory storage removed {key}")
         self.page.session.remove(key)
 
+    async def get_many(self, keys: Iterable) -> dict[Any, Any]:
+        return {key: self.page.session.get(key) for key in keys}
+
+    async def _commit(self, writes: dict, removals: Iterable):
+        # Nothing awaits in between, so no other task sees a partial commit
+        logging.debug(f"Memory storage set {list(writes)}, removed {list(removals)}")
+
+        for key, value in writes.items():
+            self.page.session.set(key, value)
+
+        for key in removals:
+            self.page.session.remove(key)
+
 
 class PersistentStorage(AsyncKeyValueStorage):
     """
     Persistent async key-value storage.
 
+    Updates are applied in memory and written behind: a snapshot of the database is
+    written at most once every flush_interval seconds, no matter how often keys change.
+    A flush_interval of 0 writes on every change. Call flush before exiting so the
+    last changes aren't lost.
+
     Locks implemented based on wikipedia's pseucode for a Readers–writer lock
     """
 
-    def __init__(self, file: TextIOBase | str = "db.json") -> None:
+    def __init__(
+        self,
+        file: TextIOBase | str = "db.json",
+        flush_interval: float = 1.0,
+        secrets: SecretStore | None = None,
+    ) -> None:
         """
         File can be the file name string to a database file or a TextIOBase if you don't want to use a file,
         such as using a StringIO object for a memory database
         """
         self._file = file
+        self.flush_interval = flush_interval
+        # The token is kept in the OS keyring instead of the database
+        self.secrets = secrets or SecretStore()
 
         self._r = asyncio.Lock()
         self._g = asyncio.Lock()
         self._b = 0
 
-        with self.get_file() as file_object:
-            try:
-                self._data: dict = json.load(file_object)
-            except json.JSONDecodeError:
-                # File is not empty, database exists but failed to load
-                if file_object.read():
-                    raise Exception("Failed to load database.")
+        self._dirty = False
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+        if isinstance(self._file, TextIOBase):
+            self._data = self._load(self._file)
+        else:
+            with self.get_file() as file_object:
+                self._data = self._load(file_object)
+
+    @staticmethod
+    def _load(file_object) -> dict:
+        try:
+            data: dict = json.load(file_object)
+        except json.JSONDecodeError:
+            # File is not empty, database exists but failed to load
+            if file_object.read():
+                raise Exception("Failed to load database.")
 
-                # File is empty so it's a new database, make an empty dict
-                self._data: dict = {}
+            # File is empty so it's a new database, make an empty dict
+            data: dict = {}
 
-            assert type(self._data) == dict, "Database file is not a dictionary"
+        assert type(data) == dict, "Database file is not a dictionary"
+        return data
 
     def get_file(self):
         if type(self._file) == str:
@@ -120,7 +219,7 @@ class PersistentStorage(AsyncKeyValueStorage):
 
     async def get(self, key) -> Any:
         if key == "token":
-            return keyring.get_password("hasherino", "token")
+            return await self.secrets.get("token")
 
         await self._begin_read()
 
@@ -132,30 +231,363 @@ class PersistentStorage(AsyncKeyValueStorage):
 
     async def set(self, key, value):
         if key == "token":
-            keyring.set_password("hasherino", "token", value)
-            # DO NOT log passwords
+            await self.secrets.set("token", value)
             return
 
         await self._begin_write()
 
         logging.debug(f"Persistent storage set {key} to {value}")
-
         self._data[key] = value
-        with self.get_file() as file_object:
-            file_object.truncate(0)
-            file_object.seek(0)
-            json.dump(self._data, file_object, sort_keys=True, indent=4)
 
         await self._end_write()
 
+        await self._mark_dirty()
+
     async def remove(self, key):
         await self._begin_write()
 
         logging.debug(f"Persistent storage removed {key}")
         self._data.pop(key)
-        with self.get_file() as file_object:
-            file_object.truncate(0)
-            file_object.seek(0)
-            json.dump(self._data, file_object, sort_keys=True, indent=4)
 
         await self._end_write()
+
+        await self._mark_dirty()
+
+    async def get_many(self, keys: Iterable) -> dict[Any, Any]:
+        keys = list(keys)
+        result = {}
+
+        if "token" in keys:
+            result["token"] = await self.get("token")
+
+        await self._begin_read()
+
+        for key in keys:
+            if key != "token":
+                result[key] = self._data.get(key, None)
+
+        await self._end_read()
+
+        return result
+
+    async def _commit(self, writes: dict, removals: Iterable):
+        writes = dict(writes)
+
+        if "token" in writes:
+            await self.set("token", writes.pop("token"))
+
+        await self._begin_write()
+
+        logging.debug(
+            f"Persistent storage set {list(writes)}, removed {list(removals)}"
+        )
+        self._data.update(writes)
+        for key in removals:
+            self._data.pop(key, None)
+
+        await self._end_write()
+
+        await self._mark_dirty()
+
+    async def _mark_dirty(self):
+        self._dirty = True
+
+        if self.flush_interval <= 0:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        # Cancelling from close shouldn't interrupt a write that already started
+        await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """
+        Writes the database if it changed since the last write.
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            await self._begin_read()
+            self._dirty = False
+            snapshot = json.dumps(self._data, sort_keys=True, indent=4)
+            await self._end_read()
+
+            try:
+                if isinstance(self._file, TextIOBase):
+                    self._file.truncate(0)
+                    self._file.seek(0)
+                    self._file.write(snapshot)
+                else:
+                    await asyncio.to_thread(self._replace_file, snapshot)
+            except Exception:
+                # Still unsaved, the next flush tries again
+                self._dirty = True
+                raise
+
+            logging.debug("Persistent storage flushed")
+
+    def _replace_file(self, snapshot: str):
+        """
+        Writes the snapshot to a temporary file and moves it over the database, so a crash
+        mid-write never leaves a truncated database behind.
+        """
+        fpath = get_default_os_settings_path() / self._file
+        tmp_path = fpath.with_name(fpath.name + ".tmp")
+
+        with open(tmp_path, "w") as file_object:
+            file_object.write(snapshot)
+            file_object.flush()
+            os.fsync(file_object.fileno())
+
+        os.replace(tmp_path, fpath)
+
+    async def close(self):
+        """
+        Cancels the pending delayed write and flushes immediately.
+        """
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+
+        await self.flush()
+
+
+class _SqliteConnection:
+    """
+    SQLite connection owned by a single executor thread, shared by every namespace of a
+    SqliteStorage.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._connection: sqlite3.Connection | None = None
+        self._tables: set[str] = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # WAL is still consistent after a crash with NORMAL, only the last commits may be lost
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        return self._connection
+
+    def _ensure_table(self, connection: sqlite3.Connection, table: str):
+        if table not in self._tables:
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID'
+            )
+            self._tables.add(table)
+
+    async def run(self, table: str, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        def call():
+            connection = self._connect()
+            self._ensure_table(connection, table)
+            return func(connection)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def close(self):
+        def close():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+        await asyncio.get_running_loop().run_in_executor(self._executor, close)
+        self._executor.shutdown()
+
+
+class SqliteStorage(AsyncKeyValueStorage):
+    """
+    Persistent async key-value storage on an embedded SQLite database in WAL mode.
+
+    Every namespace is its own table in the same database, values are stored as JSON.
+    Queries run on a single executor thread so they never block the event loop.
+    """
+
+    def __init__(
+        self,
+        file: str | Path = "hasherino.db",
+        namespace: str = "settings",
+        secrets: SecretStore | None = None,
+        _connection: _SqliteConnection | None = None,
+    ) -> None:
+        """
+        File is relative to the OS settings path, ":memory:" makes an in-memory database.
+        """
+        if not namespace.isidentifier():
+            raise ValueError(f"Invalid namespace {namespace}")
+
+        if _connection is None:
+            path = file if file == ":memory:" else get_default_os_settings_path() / file
+            _connection = _SqliteConnection(path)
+
+        self._connection = _connection
+        # The token is kept in the OS keyring instead of the database
+        self.secrets = secrets or SecretStore()
+        self.namespace = namespace
+        self._table = f"kv_{namespace}"
+
+    def with_namespace(self, namespace: str) -> "SqliteStorage":
+        """
+        Returns a storage for another namespace of the same database.
+        """
+        return SqliteStorage(
+            namespace=namespace, secrets=self.secrets, _connection=self._connection
+        )
+
+    async def get(self, key) -> Any:
+        if key == "token":
+            return await self.secrets.get("token")
+
+        row = await self._connection.run(
+            self._table,
+            lambda connection: connection.execute(
+                f'SELECT value FROM "{self._table}" WHERE key = ?', (key,)
+            ).fetchone(),
+        )
+
+        return json.loads(row[0]) if row else None
+
+    async def set(self, key, value):
+        if key == "token":
+            await self.secrets.set("token", value)
+            return
+
+        logging.debug(f"Sqlite storage {self.namespace} set {key} to {value}")
+
+        encoded = json.dumps(value)
+        await self._connection.run(
+            self._table,
+            lambda connection: connection.execute(
+                f'INSERT OR REPLACE INTO "{self._table}" (key, value) VALUES (?, ?)',
+                (key, encoded),
+            ),
+        )
+
+    async def remove(self, key):
+        logging.debug(f"Sqlite storage {self.namespace} removed {key}")
+
+        await self._connection.run(
+            self._table,
+            lambda connection: connection.execute(
+                f'DELETE FROM "{self._table}" WHERE key = ?', (key,)
+            ),
+        )
+
+    async def get_many(self, keys: Iterable) -> dict[Any, Any]:
+        keys = list(keys)
+        result = dict.fromkeys(keys)
+
+        if "token" in result:
+            result["token"] = await self.get("token")
+
+        db_keys = [key for key in keys if key != "token"]
+        placeholders = ", ".join("?" * len(db_keys))
+        rows = await self._connection.run(
+            self._table,
+            lambda connection: connection.execute(
+                f'SELECT key, value FROM "{self._table}" WHERE key IN ({placeholders})',
+                db_keys,
+            ).fetchall(),
+        )
+
+        for key, value in rows:
+            result[key] = json.loads(value)
+
+        return result
+
+    async def _commit(self, writes: dict, removals: Iterable):
+        writes = dict(writes)
+        removals = list(removals)
+
+        if "token" in writes:
+            await self.set("token", writes.pop("token"))
+
+        logging.debug(
+            f"Sqlite storage {self.namespace} set {list(writes)}, removed {removals}"
+        )
+
+        encoded = [(key, json.dumps(value)) for key, value in writes.items()]
+
+        def commit(connection: sqlite3.Connection):
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    f'INSERT OR REPLACE INTO "{self._table}" (key, value) VALUES (?, ?)',
+                    encoded,
+                )
+                connection.executemany(
+                    f'DELETE FROM "{self._table}" WHERE key = ?',
+                    ((key,) for key in removals),
+                )
+
+        await self._connection.run(self._table, commit)
+
+    async def range(
+        self, start: str | None = None, end: str | None = None, limit: int = -1
+    ) -> list[tuple[str, Any]]:
+        """
+        Returns the (key, value) pairs with start <= key < end, sorted by key.
+        """
+        conditions = []
+        parameters = []
+
+        if start is not None:
+            conditions.append("key >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("key < ?")
+            parameters.append(end)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self._connection.run(
+            self._table,
+            lambda connection: connection.execute(
+                f'SELECT key, value FROM "{self._table}" {where} ORDER BY key LIMIT ?',
+                (*parameters, limit),
+            ).fetchall(),
+        )
+
+        return [(key, json.loads(value)) for key, value in rows]
+
+    async def prefix(self, prefix: str, limit: int = -1) -> list[tuple[str, Any]]:
+        """
+        Returns the (key, value) pairs whose key starts with prefix, sorted by key.
+        """
+        # A range instead of LIKE so the primary key index is used
+        return await self.range(prefix, prefix + "\U0010ffff", limit)
+
+    async def migrate_json(self, file: str = "db.json"):
+        """
+        Imports the settings of a PersistentStorage database file into this namespace,
+        then renames the file so it's only imported once.
+        """
+        fpath = get_default_os_settings_path() / file
+
+        if not fpath.is_file():
+            return
+
+        try:
+            with open(fpath) as file_object:
+                data = PersistentStorage._load(file_object)
+        except Exception as e:
+            # The app still starts, with default settings
+            logging.error(
+                f"Not migrating settings from {fpath}, failed to read it: {e}"
+            )
+            return
+
+        await self.set_many(data)
+        os.replace(fpath, fpath.with_name(fpath.name + ".migrated"))
+
+        logging.info(f"Migrated {len(data)} settings from {fpath}")
+
+    async def close(self):
+        """
+        Closes the database, for every namespace sharing it.
+        """
+        await self._connection.close()
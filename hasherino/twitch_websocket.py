@@ -1,11 +1,10 @@
 import logging
-import ssl
 from typing import Awaitable
 
-import certifi
 import websockets
 from websockets.exceptions import ConnectionClosedError
 
+from hasherino.api import http_client
 from hasherino.parse_irc import ParsedMessage
 
 
@@ -56,12 +55,11 @@ class TwitchWebsocket:
         username: str,
         join_channel: str | None = None,
     ):
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
         async for websocket in websockets.connect(
             "wss://irc-ws.chat.twitch.tv:443",
             ping_interval=3,
             ping_timeout=2,
-            ssl=ssl_context,
+            ssl=http_client.get_ssl_context(),
         ):
             try:
                 self._websocket = websocket
@@ -1,13 +1,13 @@
 import asyncio
 import logging
-import ssl
 from pathlib import Path
 from random import randint
 from typing import Callable
 from webbrowser import open as wb_open
 
-import certifi
-from aiohttp import ClientSession, TCPConnector, web
+from aiohttp import web
+
+from hasherino.api import http_client
 
 # Field from implicit grant flow used to prevent CSRF attacks
 _STATE = str(randint(1, 100_000_000))
@@ -15,7 +15,7 @@ _STATE = str(randint(1, 100_000_000))
 _token = ""
 _error = ""
 
-__all__ = ["request_oauth_token"]
+__all__ = ["request_oauth_token", "validate_token"]
 
 
 class _WebServerContextManager:
@@ -37,19 +37,23 @@ class _WebServerContextManager:
         await self._runner.cleanup()
 
 
-async def _is_valid_token(token: str) -> bool:
+async def validate_token(token: str) -> int | None:
+    """
+    Returns the seconds until the token expires, or None if it's not valid.
+    """
     if not token:
-        return False
+        return None
+
+    session = http_client.get_session()
 
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    conn = TCPConnector(ssl=ssl_context)
+    async with session.get(
+        "https://id.twitch.tv/oauth2/validate",
+        headers={"Authorization": f"OAuth {token}"},
+    ) as response:
+        if response.status != 200:
+            return None
 
-    async with ClientSession(connector=conn) as session:
-        async with session.get(
-            "https://id.twitch.tv/oauth2/validate",
-            headers={"Authorization": f"OAuth {token}"},
-        ) as response:
-            return response.status == 200
+        return (await response.json()).get("expires_in")
 
 
 async def _browser_redirect_callback(request: web.Request) -> web.Response:
@@ -118,15 +122,18 @@ async def _home_callback(_: web.Request) -> web.Response:
     return web.Response(text=html, content_type="text/html")
 
 
-async def request_oauth_token(app_id: str, existing_token: str = "") -> str:
+async def request_oauth_token(
+    app_id: str, existing_token: str = ""
+) -> tuple[str, int | None]:
     """
     Validate existing token or ask user to authenticate with twitch and provide a new one.
+    Returns the token and the seconds until it expires, None if unknown.
 
     Raises Exception if an issue occurs while getting the token
     """
-    if await _is_valid_token(existing_token):
+    if (expires_in := await validate_token(existing_token)) is not None:
         logging.info("Provided token is valid, returning")
-        return existing_token
+        return existing_token, expires_in
 
     headers = {
         "client_id": app_id,
@@ -153,4 +160,4 @@ async def request_oauth_token(app_id: str, existing_token: str = "") -> str:
             raise Exception(_error)
 
         logging.info("Returning found token")
-        return _token
+        return _token, await validate_token(_token)